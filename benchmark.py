@@ -0,0 +1,152 @@
+# coding=utf-8
+import argparse
+import glob
+import os
+import re
+import time
+
+import soundfile as sf
+from Levenshtein import distance as levenshtein_distance
+
+from funasr import AutoModel
+from model import quantize_dynamic_int8
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+
+def list_audio(path):
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    else:
+        files = sorted(glob.glob(path))
+    return [f for f in files if f.lower().endswith(AUDIO_EXTENSIONS)]
+
+
+def audio_duration(path):
+    return sf.info(path).duration
+
+
+def plain_text(s):
+    return re.sub(r"<\|[^|]*\|>", "", s).strip()
+
+
+def char_error_rate(refs, hyps):
+    errors = sum(levenshtein_distance(r, h) for r, h in zip(refs, hyps))
+    total = sum(len(r) for r in refs)
+    return errors / max(total, 1)
+
+
+def load_references(wavs):
+    """Reference transcripts are read from `<audio>.txt` next to each file, when present."""
+    refs = []
+    for wav in wavs:
+        txt = os.path.splitext(wav)[0] + ".txt"
+        if not os.path.exists(txt):
+            return None
+        with open(txt, "r", encoding="utf-8") as f:
+            refs.append(f.read().strip())
+    return refs
+
+
+def transcribe(model, wavs, language="auto", use_itn=True):
+    # warm up allocator / kernels on the first file before timing
+    model.generate(input=wavs[0], language=language, use_itn=use_itn)
+    texts = []
+    start = time.perf_counter()
+    for wav in wavs:
+        res = model.generate(input=wav, language=language, use_itn=use_itn)
+        texts.append(plain_text(res[0]["text"]))
+    return texts, time.perf_counter() - start
+
+
+def report(name, texts, elapsed, duration, refs=None, baseline=None):
+    line = f"{name:<10} time {elapsed:8.2f}s  RTF {elapsed / duration:.4f}  x{duration / elapsed:.1f} realtime"
+    if baseline is not None:
+        line += f"  CER vs float32 {char_error_rate(baseline, texts):.4f}"
+    if refs is not None:
+        line += f"  CER vs ref {char_error_rate(refs, texts):.4f}"
+    print(line)
+
+
+def bench_quant(args):
+    wavs = list_audio(args.audio)
+    if not wavs:
+        raise FileNotFoundError(f"no audio found in {args.audio}")
+    duration = sum(audio_duration(w) for w in wavs)
+    refs = load_references(wavs)
+    print(f"{len(wavs)} files, {duration:.1f}s audio, torch threads {args.threads}")
+
+    import torch
+
+    torch.set_num_threads(args.threads)
+    model = AutoModel(model=args.model, trust_remote_code=True, remote_code="./model.py", device="cpu")
+    float_texts, float_elapsed = transcribe(model, wavs, args.language)
+    report("float32", float_texts, float_elapsed, duration, refs)
+
+    model.model = quantize_dynamic_int8(
+        model.model, cache_file=args.quant_cache, source_file=os.path.join(args.model, "model.pt")
+    )
+    int8_texts, int8_elapsed = transcribe(model, wavs, args.language)
+    report("int8", int8_texts, int8_elapsed, duration, refs, baseline=float_texts)
+    print(f"int8 speedup x{float_elapsed / int8_elapsed:.2f}")
+
+
+def bench_compile(args):
+    import random
+    import torch
+
+    torch.set_num_threads(args.threads)
+    model = AutoModel(model=args.model, trust_remote_code=True, remote_code="./model.py", device=args.device)
+    sense_voice = model.model.eval()
+    encoder = sense_voice.encoder
+    input_size = encoder.encoders0[0].in_size
+
+    # short VAD-like segments: 1 to 10 seconds, 60ms per LFR frame plus 4 prompt frames
+    random.seed(0)
+    lengths = [random.randint(17, 167) + 4 for _ in range(args.segments)]
+    segments = [torch.randn(1, t, input_size, device=args.device) for t in lengths]
+
+    def run(encoder_fn):
+        with torch.no_grad():
+            encoder_fn(segments[0].clone(), torch.tensor([lengths[0]], device=args.device))
+            if args.device.startswith("cuda"):
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            for xs, t in zip(segments, lengths):
+                encoder_fn(xs.clone(), torch.tensor([t], device=args.device))
+            if args.device.startswith("cuda"):
+                torch.cuda.synchronize()
+        return (time.perf_counter() - start) / len(segments) * 1000
+
+    eager_ms = run(encoder)
+    print(f"eager      {eager_ms:8.2f} ms/segment")
+    start = time.perf_counter()
+    runner = sense_voice.compile_encoder(buckets=args.buckets, mode=args.mode)
+    print(f"{args.mode} warmup {time.perf_counter() - start:.1f}s for buckets {args.buckets}")
+    compiled_ms = run(runner)
+    print(f"{args.mode:<10} {compiled_ms:8.2f} ms/segment  speedup x{eager_ms / compiled_ms:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SenseVoiceSmall 推理性能对比")
+    parser.add_argument("-m", "--model", default="./models/iic/SenseVoiceSmall", help="模型目录")
+    parser.add_argument("-l", "--language", default="auto", help="识别语言设置")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quant_parser = subparsers.add_parser("quant", help="float32 与 int8 动态量化的吞吐与准确率对比（CPU）")
+    quant_parser.add_argument("-a", "--audio", required=True, help="音频目录或通配路径")
+    quant_parser.add_argument("--threads", type=int, default=4, help="torch CPU 线程数")
+    quant_parser.add_argument("--quant-cache", default=None, help="量化权重缓存文件")
+    quant_parser.set_defaults(func=bench_quant)
+
+    compile_parser = subparsers.add_parser("compile", help="eager 与分档编译编码器的单段耗时对比")
+    compile_parser.add_argument("--mode", default="trace", choices=["trace", "compile"], help="编译方式")
+    compile_parser.add_argument("--buckets", type=int, nargs="+", default=[64, 128, 192, 256, 320],
+                                help="补齐长度档位（LFR 帧）")
+    compile_parser.add_argument("--segments", type=int, default=200, help="测试片段数")
+    compile_parser.add_argument("--device", default="cpu", help="推理设备")
+    compile_parser.add_argument("--threads", type=int, default=4, help="torch CPU 线程数")
+    compile_parser.set_defaults(func=bench_compile)
+
+    args = parser.parse_args()
+    args.func(args)
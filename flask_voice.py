@@ -1,8 +1,7 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from flask_sock import Sock, ConnectionClosed
 import numpy as np
-import torch
-import torchaudio
 import os
 import tempfile
 import soundfile as sf
@@ -10,10 +9,14 @@ from werkzeug.utils import secure_filename
 import json
 import subprocess
 import re
+import difflib
 from typing import List, Tuple, Optional
 
-# 导入原有模型和处理函数
-from funasr import AutoModel
+# 导入原有模型和处理函数（torch / funasr 仅在 torch 后端按需导入）
+from utils.audio_io import StreamingResampler, resample
+from utils.frontend import PcmRingBuffer, WavFrontendOnline
+from utils.infer_utils import read_yaml
+from utils.feature_cache import FeatureCache
 
 # 新增导入：纠错相关
 import pypinyin
@@ -22,6 +25,7 @@ from Levenshtein import distance as levenshtein_distance
 
 app = Flask(__name__)
 CORS(app)
+sock = Sock(app)
 
 # 全局变量定义
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'ogg', 'm4a', 'mp4'}
@@ -29,14 +33,109 @@ ALLOWED_TEXT_EXTENSIONS = {'txt'}
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 模型配置
+MODEL_CONFIG = {
+    # 推理后端："torch"（FunASR AutoModel）或 "onnx"（ONNX Runtime + FSMN-VAD，适合 CPU 节点）
+    "backend": "torch",
+    "model_dir": "./models/iic/SenseVoiceSmall",
+    "vad_model_dir": "./models/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
+    "max_single_segment_time": 10000,
+    "device": "cuda:1",
+    # CPU 节点可开启 int8 动态量化（需 device="cpu"），量化结果缓存到 quant_cache 以加快启动
+    "quantize": False,
+    "quant_cache": "./models/iic/SenseVoiceSmall/model_int8.pt",
+    # 编码器图编译："trace"（TorchScript）或 "compile"（torch.compile），None 为 eager 模式；
+    # encoder_buckets 为按 LFR 帧数（60ms/帧）划分的补齐长度，超出最大长度的批次回退到 eager 模式
+    "compile_encoder": None,
+    "encoder_buckets": (64, 128, 192, 256, 320),
+    # 流式识别：chunk_size 为 (0, 块长, 右看帧数)，单位为 60ms 的 LFR 帧；look_back 为保留的历史块数，-1 表示全部保留
+    "stream_chunk_size": (0, 10, 5),
+    "stream_look_back": -1,
+    # 流式结束时对保留的完整音频再做一次离线识别（结果更准，耗时与内存同整段离线识别）；
+    # 仅保留前 stream_offline_max_s 秒音频，流超过该时长或设为 0 时不做离线识别，直接返回流式结果
+    "stream_offline_max_s": 60,
+    # 逐字时间戳：识别时同批计算 CTC 强制对齐，结果随纠错一起映射到最终文本
+    "char_timestamps": True,
+    # 特征缓存：按音频哈希缓存 fbank/LFR/CMVN 特征（float16），同一音频换语言或 ITN 重新识别时跳过特征提取；
+    # None 表示关闭，feature_cache_max_gb 为缓存目录上限（仅 torch 后端）
+    "feature_cache_dir": None,
+    "feature_cache_max_gb": 4,
+    # ONNX 后端：onnx_model_dir 下需有 model.onnx（onnx_quantize=True 时为 model_quant.onnx）；
+    # VAD 使用导出的 ONNX 版 FSMN-VAD（含 model.onnx、config.yaml、am.mvn），整个后端不依赖 torch / funasr
+    "onnx_model_dir": "./models/iic/SenseVoiceSmall",
+    "onnx_vad_model_dir": "./models/iic/speech_fsmn_vad_zh-cn-16k-common-onnx",
+    "onnx_quantize": False,
+    # ONNX 模型变体：None 按 onnx_quantize 选择；"auto" 从 variants.json（python -m utils.export_utils 生成）中
+    # 选 CER 比 float32 模型高不超过 onnx_cer_budget 的最快变体；也可直接填写文件名，如 "model_opt.onnx"
+    "onnx_variant": None,
+    "onnx_cer_budget": 0.01,
+    "onnx_threads": 4,
+    # ONNX 会话数：>1 或 "auto" 时按 NUMA 节点/核心划分多个会话并发处理批次，每个会话 onnx_threads 个线程
+    "onnx_sessions": 1,
+    # ONNX 后端每批识别的 VAD 片段数（按长度排序后组批）
+    "onnx_batch_size": 8,
+    # 并行计算一批片段特征（fbank/LFR/CMVN）的线程数
+    "onnx_feat_workers": 4,
+    # ONNX Runtime：io_binding 复用按长度档位分配的输出缓冲区（档位补齐需本仓库 model.py 导出的模型，
+    # FunASR 原版导出的模型加载时自动退回按批内最长补齐）；cpu_mem_arena 启用 CPU 内存池
+    "onnx_io_binding": True,
+    "onnx_cpu_mem_arena": True,
+    # ORT 优化后图的缓存目录：首次加载时写入，之后直接加载以缩短冷启动；None 表示不缓存
+    "onnx_cache_dir": "./models/ort_cache",
+}
+
+
+def load_model(config):
+    """
+    按配置加载模型
+    """
+    if config.get("backend", "torch") == "onnx":
+        from utils.onnx_backend import SenseVoiceONNXPipeline
+
+        return SenseVoiceONNXPipeline(config["onnx_model_dir"],
+                                      config["onnx_vad_model_dir"],
+                                      max_single_segment_time=config["max_single_segment_time"],
+                                      quantize=config["onnx_quantize"],
+                                      batch_size=config["onnx_batch_size"],
+                                      feat_workers=config["onnx_feat_workers"],
+                                      intra_op_num_threads=config["onnx_threads"],
+                                      io_binding=config["onnx_io_binding"],
+                                      length_buckets=config["encoder_buckets"],
+                                      enable_cpu_mem_arena=config["onnx_cpu_mem_arena"],
+                                      num_sessions=config["onnx_sessions"],
+                                      variant=config["onnx_variant"],
+                                      cer_budget=config["onnx_cer_budget"],
+                                      cache_dir=config["onnx_cache_dir"])
+    from funasr import AutoModel
+    from model import quantize_dynamic_int8
+
+    model = AutoModel(model=config["model_dir"],
+                      vad_model=config["vad_model_dir"],
+                      vad_kwargs={"max_single_segment_time": config["max_single_segment_time"]},
+                      trust_remote_code=True,
+                      remote_code="./model.py",
+                      device=config["device"]
+                      )
+    if config.get("quantize"):
+        if config["device"] != "cpu":
+            raise ValueError("int8 动态量化仅支持 device=\"cpu\"")
+        model.model = quantize_dynamic_int8(model.model,
+                                            cache_file=config.get("quant_cache"),
+                                            source_file=os.path.join(config["model_dir"], "model.pt"))
+    # 预先计算语言/文本正则化提示向量，避免每次请求重复计算
+    model.model.build_prompt_cache(config["device"])
+    if config.get("compile_encoder"):
+        # 启动时按各长度档位预热编译图
+        model.model.compile_encoder(buckets=config["encoder_buckets"], mode=config["compile_encoder"])
+    return model
+
+
 # 加载模型（仅在应用启动时加载一次）
 print("正在加载模型...")
-model = AutoModel(model="./models/iic/SenseVoiceSmall",
-                  vad_model="./models/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                  vad_kwargs={"max_single_segment_time": 10000},
-                  device="cuda:1"
-                  )
+model = load_model(MODEL_CONFIG)
 print("模型加载完成!")
+FEATURE_CACHE = (FeatureCache(MODEL_CONFIG["feature_cache_dir"], int(MODEL_CONFIG["feature_cache_max_gb"] * (1 << 30)))
+                 if MODEL_CONFIG.get("feature_cache_dir") and MODEL_CONFIG.get("backend", "torch") == "torch" else None)
 
 # 从原代码复制必要的函数和字典
 emo_dict = {
@@ -110,9 +209,12 @@ class PunctuationPreserver:
     """
     标点符号位置保持器
     """
-    def __init__(self):
+    def __init__(self, char_timestamps: Optional[List] = None):
         self.punctuation_map = []  # [(汉字索引, 标点符号)]
         self.chinese_chars = []  # 纯汉字列表
+        self.char_timestamps = char_timestamps  # 可选：与输入文本逐字对应的时间戳 [起, 止]
+        self.chinese_timestamps = []  # 纯汉字对应的时间戳
+        self.restored_timestamps = None  # 恢复标点后与结果文本逐字对应的时间戳
 
     def extract_punctuation(self, text: str) -> str:
         """
@@ -120,6 +222,7 @@ class PunctuationPreserver:
         """
         self.punctuation_map = []
         self.chinese_chars = []
+        self.chinese_timestamps = []
 
         chinese_count = 0
         i = 0
@@ -128,6 +231,8 @@ class PunctuationPreserver:
             char = text[i]
             if re.match(r'[\u4e00-\u9fa5\d]', char):  # 汉字
                 self.chinese_chars.append(char)
+                if self.char_timestamps is not None:
+                    self.chinese_timestamps.append(self.char_timestamps[i])
                 chinese_count += 1
             else:  # 标点符号或其他字符
                 if char.strip():  # 非空格字符
@@ -140,15 +245,24 @@ class PunctuationPreserver:
         """
         将标点符号重新插入到纠正后的文本中
         """
+        # 如果没有对齐映射，使用简单的比例映射
+        if alignment_map is None:
+            alignment_map = self._create_proportion_mapping(len(self.chinese_chars), len(corrected_chars))
+
+        # 时间戳随对齐映射移到纠正后的位置，新插入的字没有时间
+        stamps = None
+        if self.char_timestamps is not None:
+            stamps = [None] * len(corrected_chars)
+            for old_pos, ts in enumerate(self.chinese_timestamps):
+                if old_pos < len(alignment_map) and alignment_map[old_pos] < len(stamps):
+                    stamps[alignment_map[old_pos]] = ts
+        self.restored_timestamps = stamps
+
         if not self.punctuation_map:
             return corrected_chars
 
         result = list(corrected_chars)
 
-        # 如果没有对齐映射，使用简单的比例映射
-        if alignment_map is None:
-            alignment_map = self._create_proportion_mapping(len(self.chinese_chars), len(corrected_chars))
-
         # 按位置倒序插入标点符号（避免插入位置偏移）
         for old_pos, punct in sorted(self.punctuation_map, reverse=True):
             # 计算新位置
@@ -161,6 +275,8 @@ class PunctuationPreserver:
             # 确保位置有效
             new_pos = max(0, min(new_pos, len(result)))
             result.insert(new_pos, punct)
+            if stamps is not None:
+                stamps.insert(new_pos, None)
 
         final_text = ''.join(result)
         return final_text
@@ -527,10 +643,11 @@ def simple_pinyin_correction(asr_text: str, target_text: str, preserver: Punctua
     return final_text, similarity
 
 
-def correct_with_target_text(asr_text: str, target_text: str = None, target_file_path: str = None) -> str:
+def correct_with_target_text(asr_text: str, target_text: str = None, target_file_path: str = None,
+                             preserver: PunctuationPreserver = None) -> str:
     """
     基于目标文本的古诗文纠错（保持标点符号位置）
-    支持直接传入文本或文件路径
+    支持直接传入文本或文件路径；传入带时间戳的 preserver 时，纠错后的逐字时间戳保存在 preserver.restored_timestamps
     """
     # 优先使用直接传入的文本，否则从文件加载
     if target_text:
@@ -544,7 +661,8 @@ def correct_with_target_text(asr_text: str, target_text: str = None, target_file
         return asr_text
 
     # 创建标点符号保持器
-    preserver = PunctuationPreserver()
+    if preserver is None:
+        preserver = PunctuationPreserver()
     # 进行纠错（包含标点符号处理）
     corrected_text, similarity = simple_pinyin_correction(asr_text, loaded_target_text, preserver)
     return corrected_text, similarity
@@ -565,26 +683,104 @@ def has_audio_stream(file_path):
         return False
 
 
+# 定义所有需要删除的符号和表情（覆盖所有字典的键和值）
+# 按符号长度降序排序（优先处理长组合符号，如 "<|nospeech|><|Event_UNK|>"）
+PLAIN_TEXT_SYMBOLS = sorted(
+    {symbol for symbol in {*emo_dict.keys(), *emo_dict.values(), *event_dict.keys(), *event_dict.values(),
+                           *emoji_dict.keys(), *emoji_dict.values(), *lang_dict.keys(), *emo_set, *event_set}
+     if symbol},
+    key=lambda x: len(x), reverse=True)
+
+
 def extract_plain_text(s):
-    # 定义所有需要删除的符号和表情（覆盖所有字典的键和值）
-    symbols_to_remove = {
-        *emo_dict.keys(),
-        *emo_dict.values(),
-        *event_dict.keys(),
-        *event_dict.values(),
-        *emoji_dict.keys(),
-        *emoji_dict.values(),
-        *lang_dict.keys(),
-        *emo_set,
-        *event_set
-    }
-    symbols_to_remove = {symbol for symbol in symbols_to_remove if symbol}
-    # 按符号长度降序排序（优先处理长组合符号，如 "<|nospeech|><|Event_UNK|>"）
-    sorted_symbols = sorted(symbols_to_remove, key=lambda x: len(x), reverse=True)
-    for symbol in sorted_symbols:
-        s = s.replace(symbol, "")
-    s = ' '.join(s.split())
-    return s
+    return extract_plain_text_with_index(s)[0]
+
+
+def extract_plain_text_with_index(s):
+    """
+    去除特殊符号并合并空白，同时返回结果中每个字符在原文本中的位置
+    """
+    index = list(range(len(s)))
+    for symbol in PLAIN_TEXT_SYMBOLS:
+        if symbol not in s:
+            continue
+        pieces = s.split(symbol)
+        kept, pos = [], 0
+        for piece in pieces:
+            kept.extend(index[pos:pos + len(piece)])
+            pos += len(piece) + len(symbol)
+        s, index = ''.join(pieces), kept
+
+    # 等价于 ' '.join(s.split())
+    text, text_index = [], []
+    space = None
+    for char, pos in zip(s, index):
+        if char.isspace():
+            if text and space is None:
+                space = pos
+            continue
+        if space is not None:
+            text.append(' ')
+            text_index.append(space)
+            space = None
+        text.append(char)
+        text_index.append(pos)
+    return ''.join(text), text_index
+
+
+def split_time_span(start: float, end: float, n: int) -> List[List[float]]:
+    """
+    将 [start, end] 平均分给 n 个字符
+    """
+    step = (end - start) / n
+    return [[round(start + k * step, 3), round(start + (k + 1) * step, 3)] for k in range(n)]
+
+
+TAG_PATTERN = re.compile(r"<\|[^|]*\|>")
+
+
+def char_timestamps_from_result(result) -> List[Optional[List[float]]]:
+    """
+    由识别结果的逐 token 时间戳（毫秒）得到与 result["text"] 逐字对应的时间戳 [起, 止]（秒），
+    标签、空格等没有时间的字符为 None
+    """
+    text = result["text"]
+    stamps = [None] * len(text)
+    # <|zh|><|NEUTRAL|> 等标签内的字母不参与匹配，否则 token 里的 e、N 等会对到标签上
+    in_tag = [False] * len(text)
+    for tag in TAG_PATTERN.finditer(text):
+        in_tag[tag.start():tag.end()] = [True] * (tag.end() - tag.start())
+    pos = 0
+    for token, (start, end) in zip(result.get("tokens", []), result.get("timestamp", [])):
+        chars = token.strip()
+        if not chars or TAG_PATTERN.fullmatch(chars):
+            continue
+        for char, span in zip(chars, split_time_span(start / 1000, end / 1000, len(chars))):
+            found = text.find(char, pos)
+            while found >= 0 and in_tag[found]:
+                found = text.find(char, found + 1)
+            if found < 0:
+                continue
+            stamps[found] = span
+            pos = found + 1
+    return stamps
+
+
+def remap_char_timestamps(old_text: str, new_text: str, char_timestamps: List) -> List:
+    """
+    文本被改写（如文本正则化）后，按字符差异把逐字时间戳映射到新文本：
+    相同的字直接沿用，被改写的片段在原片段的时间范围内平均分配
+    """
+    stamps = [None] * len(new_text)
+    matcher = difflib.SequenceMatcher(None, old_text, new_text, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            stamps[j1:j2] = char_timestamps[i1:i2]
+        elif tag == 'replace':
+            known = [ts for ts in char_timestamps[i1:i2] if ts]
+            if known:
+                stamps[j1:j2] = split_time_span(known[0][0], known[-1][1], j2 - j1)
+    return stamps
 
 
 def allowed_file(filename):
@@ -597,60 +793,198 @@ def allowed_text_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_TEXT_EXTENSIONS
 
 
+# 修改：添加 "ancient zh" 映射到 "zh"
+LANGUAGE_ABBR = {"auto": "auto", "zh": "zh", "ancient zh": "zh", "en": "en", "yue": "yue", "ja": "ja", "ko": "ko",
+                 "nospeech": "nospeech"}
+
+
+def postprocess_text(text, language="auto", target_text=None, target_file_path=None, char_timestamps=None):
+    """
+    识别结果后处理：去除特殊符号、文本正则化、基于目标文本纠错
+    char_timestamps 为与 text 逐字对应的时间戳，随每一步处理映射到最终文本
+    """
+    text_final, index = extract_plain_text_with_index(text)
+    if char_timestamps is not None:
+        char_timestamps = [char_timestamps[pos] for pos in index]
+
+    # 修改：文本正则化（仅在古代中文模式下进行）
+    if language == "ancient zh" or language == "zh":
+        try:
+            from tn.chinese.normalizer import Normalizer
+            normalizer = Normalizer(overwrite_cache=True, full_to_half=False, remove_erhua=False,
+                                    remove_interjections=False, traditional_to_simple=False)
+            normalized = normalizer.normalize(text_final)
+            if char_timestamps is not None:
+                char_timestamps = remap_char_timestamps(text_final, normalized, char_timestamps)
+            text_final = normalized
+        except ImportError:
+            pass  # 如果没有tn库，跳过正则化
+
+    # 修改：仅在古代中文模式且提供了目标文本或文件时进行纠错
+    similarity = 0.0
+    correction_enabled = False
+    if (language == "ancient zh" or language=="zh") and (target_text or (target_file_path and os.path.exists(target_file_path))):
+        preserver = PunctuationPreserver(char_timestamps)
+        text_final, similarity = correct_with_target_text(text_final, target_text, target_file_path, preserver)
+        if char_timestamps is not None:
+            char_timestamps = preserver.restored_timestamps
+        if similarity > 0.3:
+            correction_enabled = True
+
+    result = {
+        "text": text_final,
+        "language": language,
+        "correction_enabled": correction_enabled,
+        "similarity": similarity
+    }
+    if char_timestamps is not None:
+        # [字, 起始秒, 结束秒]，没有时间的字符（标点、补入的字）为 None
+        result["char_timestamps"] = [[char, *(ts or (None, None))]
+                                     for char, ts in zip(text_final, char_timestamps) if not char.isspace()]
+    return result
+
+
+def recognize_with_timestamps(audio_input, language, use_itn=True):
+    """
+    识别并（按配置）在同一批次中计算逐字时间戳，返回 (原始文本, 逐字时间戳或 None)
+    ONNX 后端不输出时间戳
+    """
+    output_timestamp = MODEL_CONFIG.get("char_timestamps", False) and MODEL_CONFIG.get("backend", "torch") == "torch"
+    res = model.generate(input=audio_input,
+                         cache={},
+                         language=language,
+                         use_itn=use_itn,
+                         batch_size_s=300,
+                         merge_vad=True,
+                         output_timestamp=output_timestamp,
+                         timestamp_format="ms",
+                         feature_cache=FEATURE_CACHE)
+    return res[0]["text"], char_timestamps_from_result(res[0]) if output_timestamp else None
+
+
 def process_audio(audio_path, language="auto", target_text=None, target_file_path=None):
     try:
-        # 修改：添加 "ancient zh" 映射到 "zh"
-        language_abbr = {"auto": "auto", "zh": "zh", "ancient zh": "zh", "en": "en", "yue": "yue", "ja": "ja", "ko": "ko",
-                         "nospeech": "nospeech"}
-        selected_language = language_abbr.get(language, "auto")
-
-        merge_vad = True
+        selected_language = LANGUAGE_ABBR.get(language, "auto")
 
         # 检查文件是否包含音频流
         if not has_audio_stream(audio_path):
             return "未识别到文本"
 
-        text = model.generate(input=audio_path,
-                              cache={},
-                              language=selected_language,
-                              use_itn=True,
-                              batch_size_s=300,
-                              merge_vad=merge_vad)
-
-        text = text[0]["text"]
-        text_final = extract_plain_text(text)
-
-        # 修改：文本正则化（仅在古代中文模式下进行）
-        if language == "ancient zh" or language == "zh":
-            try:
-                from tn.chinese.normalizer import Normalizer
-                normalizer = Normalizer(overwrite_cache=True, full_to_half=False, remove_erhua=False,
-                                        remove_interjections=False, traditional_to_simple=False)
-                text_final = normalizer.normalize(text_final)
-            except ImportError:
-                pass  # 如果没有tn库，跳过正则化
-
-        # 修改：仅在古代中文模式且提供了目标文本或文件时进行纠错
-        similarity = 0.0
-        correction_enabled = False
-        if (language == "ancient zh" or language=="zh") and (target_text or (target_file_path and os.path.exists(target_file_path))):
-            text_final, similarity = correct_with_target_text(text_final, target_text, target_file_path)
-            if similarity > 0.3:
-                correction_enabled = True
-
-        return {
-            "text": text_final,
-            "language": language,
-            "correction_enabled": correction_enabled,
-            "similarity": similarity
-        }
+        text, char_timestamps = recognize_with_timestamps(audio_path, selected_language)
+
+        return postprocess_text(text, language, target_text, target_file_path, char_timestamps)
     except Exception as e:
         raise e
 
 
+class StreamingSession:
+    """
+    单个 WebSocket 连接的流式识别状态
+    """
+    def __init__(self, language="auto", use_itn=True, sample_rate=16000):
+        if MODEL_CONFIG.get("backend", "torch") != "torch":
+            raise RuntimeError("流式识别仅支持 backend=\"torch\"")
+        frontend_conf = read_yaml(os.path.join(MODEL_CONFIG["model_dir"], "config.yaml"))["frontend_conf"]
+        frontend_conf["cmvn_file"] = os.path.join(MODEL_CONFIG["model_dir"], "am.mvn")
+        frontend_conf["dither"] = 0.0
+        self.frontend = WavFrontendOnline(**frontend_conf)
+        self.cache = model.model.init_stream_cache(language=LANGUAGE_ABBR.get(language, "auto"),
+                                                   use_itn=use_itn,
+                                                   chunk_size=MODEL_CONFIG["stream_chunk_size"],
+                                                   look_back=MODEL_CONFIG["stream_look_back"])
+        self.language = language
+        self.use_itn = use_itn
+        # PCM 按块直接转换进预分配的 float32 缓冲区；最多保留 stream_offline_max_s 秒音频供 finalize 离线识别，
+        # 超出后丢弃历史，内存不随连接时长增长
+        offline_max_s = MODEL_CONFIG.get("stream_offline_max_s", 60)
+        self.pcm = PcmRingBuffer(keep_history=offline_max_s > 0, max_history=int(offline_max_s * sample_rate))
+        # 非 16kHz 输入按块重采样，滤波核在进程内按采样率缓存共享
+        self.sample_rate = sample_rate
+        self.fs = int(frontend_conf.get("fs", 16000))
+        self.resampler = StreamingResampler(sample_rate, self.fs) if sample_rate != self.fs else None
+        self.text = ""
+
+    def accept_pcm(self, pcm: bytes, is_final: bool = False) -> str:
+        """
+        输入一段 16bit 单声道 PCM（采样率为 sample_rate），返回当前的中间识别结果
+        """
+        self.pcm.push(pcm)
+        waveform = self.pcm.read()
+        if self.pcm.num_written == 0:
+            return self.text
+        if self.resampler is not None:
+            waveform = self.resampler.process(waveform, final=is_final)
+
+        feats, _ = self.frontend.extract_fbank(waveform[None, :], np.array([len(waveform)]), is_final)
+        if feats.ndim == 3 and feats.shape[1] > 0 or is_final:
+            if feats.ndim != 3:
+                feats = np.zeros((1, 0, self.frontend.feat_dim()), dtype=np.float32)
+            import torch
+
+            self.text = model.model.inference_chunk(torch.from_numpy(feats), self.cache, is_final=is_final,
+                                                    tokenizer=model.kwargs["tokenizer"])
+        return self.text
+
+    def finalize(self, target_text=None):
+        """
+        结束流式识别：音频仍在保留范围内时对完整音频做一次离线识别，否则使用流式结果，得到最终（纠错后）结果
+        """
+        self.accept_pcm(b"", is_final=True)
+        if self.pcm.num_written == 0:
+            return postprocess_text("", self.language)
+        if not self.pcm.keep_history:
+            return postprocess_text(self.text, self.language, target_text)
+        text, char_timestamps = recognize_with_timestamps(resample(self.pcm.history(), self.sample_rate, self.fs),
+                                                          LANGUAGE_ABBR.get(self.language, "auto"),
+                                                          use_itn=self.use_itn)
+        return postprocess_text(text, self.language, target_text, char_timestamps=char_timestamps)
+
+
+@sock.route('/stream')
+def stream_recognize(ws):
+    """
+    流式识别接口（WebSocket）：
+    1. 客户端先发送 JSON 文本消息，如 {"language": "zh", "target_string": "..."}
+    2. 随后持续发送 16bit 单声道 PCM 二进制数据（默认 16kHz，其他采样率可在第 1 步用 "sample_rate" 指定，
+       服务端重采样），服务端每解码完一个块返回 {"text": ..., "is_final": false}
+    3. 发送 {"is_final": true} 结束，服务端返回最终结果 {"text": ..., "is_final": true, ...} 后关闭连接
+    """
+    try:
+        options = json.loads(ws.receive())
+        language = options.get("language", "auto")
+        session = StreamingSession(language, sample_rate=int(options.get("sample_rate", 16000)))
+        last_text = ""
+        while True:
+            message = ws.receive()
+            if isinstance(message, str):
+                if json.loads(message).get("is_final"):
+                    break
+                continue
+            text = extract_plain_text(session.accept_pcm(message))
+            if text != last_text:
+                ws.send(json.dumps({"text": text, "is_final": False}, ensure_ascii=False))
+                last_text = text
+
+        result = session.finalize(options.get("target_string"))
+        result["is_final"] = True
+        ws.send(json.dumps(result, ensure_ascii=False))
+    except ConnectionClosed:
+        # 客户端已断开，不再回复
+        return
+    except Exception as e:
+        try:
+            ws.send(json.dumps({"error": str(e)}, ensure_ascii=False))
+        except Exception:
+            # 回复错误时连接已不可用，忽略
+            pass
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "message": "服务运行正常"})
+    status = {"status": "ok", "message": "服务运行正常"}
+    if hasattr(model, "stats"):
+        status["onnx_sessions"] = model.stats()
+    return jsonify(status)
 
 
 @app.route('/recognize', methods=['POST'])
@@ -703,6 +1037,8 @@ def recognize_speech():
             if result["language"] == "ancient zh" or result["language"] == "zh":
                 response_data["correction_enabled"] = result["correction_enabled"]
                 response_data["similarity"] = result["similarity"]
+            if "char_timestamps" in result:
+                response_data["char_timestamps"] = result["char_timestamps"]
 
             return jsonify(response_data)
         finally:
@@ -1,18 +1,30 @@
 # coding=utf-8
 import numpy as np
-import torch
-import torchaudio
 import argparse
 
-from funasr import AutoModel
+from utils.audio_io import resample
 
-model = "./models/iic/SenseVoiceSmall"
-model = AutoModel(model=model,
-                  vad_model="./models/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                  vad_kwargs={"max_single_segment_time": 30000},
-                  trust_remote_code=True,
-                  device="cuda:0"
-                  )
+MODEL_DIR = "./models/iic/SenseVoiceSmall"
+VAD_MODEL_DIR = "./models/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch"
+# onnx 后端使用导出的 ONNX 版 FSMN-VAD，不加载 torch / funasr
+ONNX_VAD_MODEL_DIR = "./models/iic/speech_fsmn_vad_zh-cn-16k-common-onnx"
+
+# 首次识别时才加载，批量模式按自己的后端和设备加载，不会先在 cuda:0 上加载一份完整模型
+model = None
+
+
+def load_model(device="cuda:0"):
+    global model
+    if model is None:
+        from funasr import AutoModel
+
+        model = AutoModel(model=MODEL_DIR,
+                          vad_model=VAD_MODEL_DIR,
+                          vad_kwargs={"max_single_segment_time": 30000},
+                          trust_remote_code=True,
+                          device=device
+                          )
+    return model
 
 
 emo_dict = {
@@ -168,18 +180,19 @@ def model_inference(input_wav, language, fs=16000):
 
     if isinstance(input_wav, tuple):
         fs, input_wav = input_wav
-        input_wav = input_wav.astype(np.float32) / np.iinfo(np.int16).max
+        # 下混与缩放都在同一个 float32 缓冲区上完成，重采样核按 (fs, 16000) 缓存复用
         if len(input_wav.shape) > 1:
-            input_wav = input_wav.mean(-1)
+            input_wav = input_wav.mean(-1, dtype=np.float32)
+        else:
+            input_wav = input_wav.astype(np.float32)
+        input_wav *= 1.0 / np.iinfo(np.int16).max
         if fs != 16000:
             print(f"audio_fs: {fs}")
-            resampler = torchaudio.transforms.Resample(fs, 16000)
-            input_wav_t = torch.from_numpy(input_wav).to(torch.float32)
-            input_wav = resampler(input_wav_t[None, :])[0, :].numpy()
+            input_wav = resample(input_wav, fs, 16000)
 
     merge_vad = True  # False if selected_task == "ASR" else True
     print(f"language: {language}, merge_vad: {merge_vad}")
-    text = model.generate(input=input_wav,
+    text = load_model().generate(input=input_wav,
                           cache={},
                           language=language,
                           use_itn=True,
@@ -197,13 +210,58 @@ def model_inference(input_wav, language, fs=16000):
 
 
 
+def batch_inference(args):
+    """
+    批量识别：解码线程并行读取、重采样音频，多个文件的 VAD 片段凑批识别，
+    结果逐文件追加写入 JSONL，中断后重新运行同一命令即从已完成处继续
+    """
+    from utils.batch_transcribe import SenseVoiceTorchPipeline, iter_inputs, transcribe_files
+
+    if args.backend == "onnx":
+        from utils.onnx_backend import SenseVoiceONNXPipeline
+
+        pipeline = SenseVoiceONNXPipeline(args.model_dir, ONNX_VAD_MODEL_DIR,
+                                          max_single_segment_time=30000,
+                                          batch_size=args.batch_size,
+                                          feat_workers=args.feat_workers,
+                                          intra_op_num_threads=args.threads)
+    else:
+        pipeline = SenseVoiceTorchPipeline(args.model_dir, VAD_MODEL_DIR,
+                                           device=args.device,
+                                           max_single_segment_time=30000,
+                                           batch_size=args.batch_size)
+    stats = transcribe_files(pipeline,
+                             iter_inputs(args.input),
+                             args.output,
+                             workers=args.workers,
+                             batch_size=args.batch_size,
+                             language=args.language,
+                             use_itn=True,
+                             postprocess=extract_plain_text)
+    print(f"{stats['files']} files ({stats['audio_s'] / 3600:.2f} h audio) in {stats['elapsed_s']:.0f}s, "
+          f"{stats['errors']} errors -> {args.output}")
+
+
 if __name__ == "__main__":
     # iface.launch()
     parser = argparse.ArgumentParser()
     parser.add_argument("-a", "--audio", default="./audio/longwav_2.wav", help="输入音频路径（支持WAV/MP3等）")
     parser.add_argument("-l", "--language", default="auto", choices=["auto", "zh", "en", "yue", "ja", "ko", "nospeech"], help="识别语言设置（默认auto自动检测）")
+    parser.add_argument("--device", default="cuda:0", help="推理设备，如 cuda:0、cpu")
+    batch_group = parser.add_argument_group("批量识别")
+    batch_group.add_argument("-i", "--input", default=None,
+                             help="批量识别输入：音频目录、通配路径（如 './data/**/*.wav'）或 JSONL 清单（每行含 key、source）；指定后忽略 --audio")
+    batch_group.add_argument("-o", "--output", default="./results.jsonl", help="批量识别结果 JSONL，已有结果的音频在重新运行时跳过")
+    batch_group.add_argument("--backend", default="torch", choices=["torch", "onnx"], help="推理后端")
+    batch_group.add_argument("--model-dir", default=MODEL_DIR, help="模型目录（onnx 后端需含 model.onnx）")
+    batch_group.add_argument("--workers", type=int, default=4, help="并行解码、重采样音频的线程数")
+    batch_group.add_argument("--batch-size", type=int, default=16, help="每批识别的 VAD 片段数")
+    batch_group.add_argument("--feat-workers", type=int, default=4, help="onnx 后端并行提取特征的线程数")
+    batch_group.add_argument("--threads", type=int, default=4, help="onnx 后端 ONNX Runtime 线程数")
 
     args = parser.parse_args()
-    model_inference(args.audio, args.language)
-
-
+    if args.input:
+        batch_inference(args)
+    else:
+        load_model(args.device)
+        model_inference(args.audio, args.language)
@@ -1,5 +1,9 @@
 
+import hashlib
+import os
 import time
+from itertools import groupby
+import numpy as np
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -40,9 +44,9 @@ class SinusoidalPositionEncoder(torch.nn.Module):
         encoding = torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=2)
         return encoding.type(dtype)
 
-    def forward(self, x):
+    def forward(self, x, start_idx: int = 0):
         batch_size, timesteps, input_dim = x.size()
-        positions = torch.arange(1, timesteps + 1, device=x.device)[None, :]
+        positions = torch.arange(start_idx + 1, start_idx + timesteps + 1, device=x.device)[None, :]
         position_encoding = self.encode(positions, input_dim, x.dtype).to(x.device)
 
         return x + position_encoding
@@ -549,7 +553,7 @@ class SenseVoiceEncoderSmall(nn.Module):
         ilens: torch.Tensor,
     ):
         """Embed positions in tensor."""
-        masks = sequence_mask(ilens, device=ilens.device)[:, None, :]
+        masks = sequence_mask(ilens, maxlen=xs_pad.size(1), device=ilens.device)[:, None, :]
 
         xs_pad *= self.output_size() ** 0.5
 
@@ -576,6 +580,112 @@ class SenseVoiceEncoderSmall(nn.Module):
         xs_pad = self.tp_norm(xs_pad)
         return xs_pad, olens
 
+    def forward_chunk(self, xs_pad: torch.Tensor, cache: dict):
+        """Encode one chunk of features with the k/v caches of the previous chunks.
+
+        `cache` carries "chunk_size" (_, chunk, lookahead), "look_back", the frame offset
+        "start_idx" and the per-layer attention caches "layers"; it is updated in place.
+        The last `lookahead` input frames are only right context, the next chunk has to
+        start with them again.
+        """
+        chunk_size, look_back = cache["chunk_size"], cache["look_back"]
+        if cache.get("layers") is None:
+            cache["layers"] = [None] * (
+                len(self.encoders0) + len(self.encoders) + len(self.tp_encoders)
+            )
+
+        xs_pad = xs_pad * self.output_size() ** 0.5
+        xs_pad = self.embed(xs_pad, cache["start_idx"])
+        cache["start_idx"] += max(xs_pad.size(1) - chunk_size[2], 0)
+
+        layer_idx = 0
+        for encoder_layer in [*self.encoders0, *self.encoders]:
+            xs_pad, cache["layers"][layer_idx] = encoder_layer.forward_chunk(
+                xs_pad, cache["layers"][layer_idx], chunk_size, look_back
+            )
+            layer_idx += 1
+
+        xs_pad = self.after_norm(xs_pad)
+
+        for encoder_layer in self.tp_encoders:
+            xs_pad, cache["layers"][layer_idx] = encoder_layer.forward_chunk(
+                xs_pad, cache["layers"][layer_idx], chunk_size, look_back
+            )
+            layer_idx += 1
+
+        xs_pad = self.tp_norm(xs_pad)
+        return xs_pad
+
+
+class BucketedEncoder:
+    """Encoder runner with graphs traced or compiled for a fixed set of padded lengths.
+
+    Each batch is zero padded to the smallest bucket that fits it, padded frames are
+    masked out by `ilens` so the valid outputs match eager mode. Batches longer than the
+    largest bucket run the eager encoder.
+    """
+
+    def __init__(self, encoder: SenseVoiceEncoderSmall, buckets=(64, 128, 192, 256, 320), mode="trace"):
+        assert mode in ("trace", "compile")
+        self.encoder = encoder
+        self.buckets = sorted(buckets)
+        self.mode = mode
+        self.graphs = {}
+
+    def warmup(self, device, dtype=torch.float32, batch_sizes=(4, 1)):
+        """Build the graph of every bucket and run it at each of `batch_sizes`.
+
+        One trace serves all batch sizes of a bucket: it is made at the first batch size and
+        checked against the eager encoder at the others, on batches with padded items. Compiled
+        graphs are built for each of `batch_sizes` up front.
+        """
+        input_size = self.encoder.encoders0[0].in_size
+        for length in self.buckets:
+            examples = []
+            for batch_size in batch_sizes:
+                xs_pad = torch.randn((batch_size, length, input_size), device=device, dtype=dtype)
+                ilens = torch.full((batch_size,), length, device=device, dtype=torch.int32)
+                ilens[1:] = torch.linspace(length // 2, length, batch_size + 1, dtype=torch.int32)[:-2]
+                examples.append((xs_pad, ilens))
+            graph = self._graph(length, *examples[0], check_inputs=examples[1:])
+            for xs_pad, ilens in examples:
+                self._run(graph, xs_pad.clone(), ilens)
+
+    def _graph(self, length: int, xs_pad: torch.Tensor, ilens: torch.Tensor, check_inputs=()):
+        graph = self.graphs.get(length)
+        if graph is None:
+            if self.mode == "compile":
+                graph = torch.compile(self.encoder, dynamic=False)
+            else:
+                # the encoder scales xs_pad in place, trace and check on copies
+                check_inputs = [(x.clone(), l) for x, l in ((xs_pad, ilens), *check_inputs)]
+                with torch.no_grad():
+                    graph = torch.jit.trace(
+                        self.encoder, (xs_pad.clone(), ilens), check_trace=True, check_inputs=check_inputs
+                    )
+            self.graphs[length] = graph
+        return graph
+
+    def _run(self, graph, xs_pad: torch.Tensor, ilens: torch.Tensor):
+        if self.mode == "compile":
+            # only a hint: dynamo recompiles per batch size where the encoder needs a static one
+            torch._dynamo.maybe_mark_dynamic(xs_pad, 0)
+            torch._dynamo.maybe_mark_dynamic(ilens, 0)
+        return graph(xs_pad, ilens)
+
+    def __call__(self, xs_pad: torch.Tensor, ilens: torch.Tensor):
+        b, t, d = xs_pad.size()
+        length = next((bucket for bucket in self.buckets if bucket >= t), None)
+        if length is None:
+            return self.encoder(xs_pad, ilens)
+
+        if length != t:
+            padded = xs_pad.new_zeros((b, length, d))
+            padded[:, :t] = xs_pad
+            xs_pad = padded
+        encoder_out, encoder_out_lens = self._run(self._graph(length, xs_pad, ilens), xs_pad, ilens)
+        return encoder_out[:, :t], encoder_out_lens
+
 
 @tables.register("model_classes", "SenseVoiceSmall")
 class SenseVoiceSmall(nn.Module):
@@ -777,6 +887,52 @@ class SenseVoiceSmall(nn.Module):
 
         return loss_rich, acc_rich
 
+    def cached_fbank(self, data_in, frontend, tokenizer, meta_data=None, **kwargs):
+        """
+        Features of a batch through a utils.feature_cache.FeatureCache: inputs seen before are
+        read back, only the others are loaded and extracted (and stored). All features go
+        through the cache's float16, so warm and cold decodes agree. The keys include the CMVN
+        stats in use, so replacing am.mvn does not hit features normalized with the old ones.
+        Timings go to `meta_data` like the uncached path ("load_data" covers the cache reads).
+        """
+        feature_cache = kwargs["feature_cache"]
+        meta_data = {} if meta_data is None else meta_data
+        time1 = time.perf_counter()
+        items = list(data_in) if isinstance(data_in, (list, tuple)) else [data_in]
+        cmvn = getattr(frontend, "cmvn", None)
+        config = dict(
+            kwargs.get("frontend_conf") or {},
+            frontend=type(frontend).__name__,
+            fs=frontend.fs,
+            audio_fs=kwargs.get("fs", 16000),
+            cmvn=None if cmvn is None else hashlib.sha256(torch.as_tensor(cmvn).cpu().contiguous().numpy()).hexdigest(),
+        )
+        keys = [feature_cache.key(item, config) for item in items]
+        feats = [feature_cache.get(key) for key in keys]
+        missing = [i for i, feat in enumerate(feats) if feat is None]
+        time2 = time.perf_counter()
+        if missing:
+            audio_sample_list = load_audio_text_image_video(
+                [items[i] for i in missing],
+                fs=frontend.fs,
+                audio_fs=kwargs.get("fs", 16000),
+                data_type=kwargs.get("data_type", "sound"),
+                tokenizer=tokenizer,
+            )
+            time2 = time.perf_counter()
+            speech, speech_lengths = extract_fbank(
+                audio_sample_list, data_type=kwargs.get("data_type", "sound"), frontend=frontend
+            )
+            for i, feat, length in zip(missing, speech, speech_lengths.tolist()):
+                feats[i] = feature_cache.put(keys[i], feat[:length].cpu().numpy())
+        meta_data["load_data"] = f"{time2 - time1:0.3f}"
+
+        speech_lengths = torch.tensor([len(feat) for feat in feats], dtype=torch.int32)
+        speech = torch.zeros((len(feats), int(speech_lengths.max()), feats[0].shape[1]))
+        for i, feat in enumerate(feats):
+            speech[i, : len(feat)] = torch.from_numpy(np.asarray(feat, dtype=np.float32))
+        meta_data["extract_feat"] = f"{time.perf_counter() - time2:0.3f}"
+        return speech, speech_lengths
 
     def inference(
         self,
@@ -798,6 +954,11 @@ class SenseVoiceSmall(nn.Module):
                 speech = speech[None, :, :]
             if speech_lengths is None:
                 speech_lengths = speech.shape[1]
+        elif kwargs.get("feature_cache") is not None and data_lengths is None:
+            speech, speech_lengths = self.cached_fbank(data_in, frontend, tokenizer, meta_data, **kwargs)
+            meta_data["batch_data_time"] = (
+                speech_lengths.sum().item() * frontend.frame_shift * frontend.lfr_n / 1000
+            )
         else:
             # extract fbank feats
             time1 = time.perf_counter()
@@ -823,33 +984,28 @@ class SenseVoiceSmall(nn.Module):
         speech_lengths = speech_lengths.to(device=kwargs["device"])
 
         language = kwargs.get("language", "auto")
-        language_query = self.embed(
-            torch.LongTensor(
-                [[self.lid_dict[language] if language in self.lid_dict else 0]]
-            ).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        
         use_itn = kwargs.get("use_itn", False)
         output_timestamp = kwargs.get("output_timestamp", False)
 
         textnorm = kwargs.get("text_norm", None)
         if textnorm is None:
             textnorm = "withitn" if use_itn else "woitn"
-        textnorm_query = self.embed(
-            torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        speech = torch.cat((textnorm_query, speech), dim=1)
-        speech_lengths += 1
 
-        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
-            speech.size(0), 1, 1
-        )
-        input_query = torch.cat((language_query, event_emo_query), dim=1)
-        speech = torch.cat((input_query, speech), dim=1)
-        speech_lengths += 3
+        # [language, event, emotion, textnorm] queries are written in front of the
+        # features in one buffer instead of being embedded and concatenated per call
+        prompt = self.build_prompt_cache(speech.device, speech.dtype)[
+            self.prompt_index(language, textnorm)
+        ]
+        b, t, d = speech.size()
+        speech_in = speech.new_empty((b, t + prompt.size(0), d))
+        speech_in[:, : prompt.size(0)] = prompt
+        speech_in[:, prompt.size(0) :] = speech
+        speech = speech_in
+        speech_lengths = speech_lengths + prompt.size(0)
 
         # Encoder
-        encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
+        encoder = getattr(self, "bucketed_encoder", None) or self.encoder
+        encoder_out, encoder_out_lens = encoder(speech, speech_lengths)
         if isinstance(encoder_out, tuple):
             encoder_out = encoder_out[0]
 
@@ -864,9 +1020,10 @@ class SenseVoiceSmall(nn.Module):
             key = key[0]
         if len(key) < b:
             key = key * b
+        yseqs = ctc_logits.argmax(dim=-1)
+        texts, token_ints = [], []
         for i in range(b):
-            x = ctc_logits[i, : encoder_out_lens[i].item(), :]
-            yseq = x.argmax(dim=-1)
+            yseq = yseqs[i, : encoder_out_lens[i].item()]
             yseq = torch.unique_consecutive(yseq, dim=-1)
 
             ibest_writer = None
@@ -882,44 +1039,209 @@ class SenseVoiceSmall(nn.Module):
             text = tokenizer.decode(token_int)
             if ibest_writer is not None:
                 ibest_writer["text"][key[i]] = text
+            texts.append(text)
+            token_ints.append(token_int)
 
-            if output_timestamp:
-                from itertools import groupby
-                timestamp = []
-                tokens = tokenizer.text2tokens(text)[4:]
+        if output_timestamp:
+            spans = self._align_timestamps(
+                ctc_logits, yseqs, [token_int[4:] for token_int in token_ints], encoder_out_lens - 4
+            )
+            # "ms": [start_ms, end_ms] per token plus a separate "tokens" list, the layout FunASR
+            # shifts by the segment offset when merging VAD segments
+            if kwargs.get("timestamp_format", "token") == "ms":
+                for i in range(b):
+                    results.append({
+                        "key": key[i],
+                        "text": texts[i],
+                        "timestamp": [[round(l * 1000), round(r * 1000)] for l, r in spans[i]],
+                        "tokens": [tokenizer.decode([token]) for token in token_ints[i][4:]],
+                    })
+                return results, meta_data
+            for i in range(b):
+                tokens = tokenizer.text2tokens(texts[i])[4:]
+                timestamp = [[tokens[j], ts_left, ts_right] for j, (ts_left, ts_right) in enumerate(spans[i])]
+                results.append({"key": key[i], "text": texts[i], "timestamp": timestamp})
+        else:
+            for i in range(b):
+                results.append({"key": key[i], "text": texts[i]})
+        return results, meta_data
 
-                logits_speech = self.ctc.softmax(encoder_out)[i, 4:encoder_out_lens[i].item(), :]
+    def _timestamp_emission(self, ctc_logits: torch.Tensor, yseqs: torch.Tensor):
+        """Forced-alignment emission of a whole batch, computed once from the CTC log-probs.
 
-                pred = logits_speech.argmax(-1).cpu()
-                logits_speech[pred==self.blank_id, self.blank_id] = 0
+        Only the blank and the greedily decoded token ids can appear in an alignment, so just
+        these columns (`vocab_ids`, sorted) are turned back into probabilities instead of a
+        second softmax over the full vocabulary per item. As before, the blank probability is
+        zeroed on frames where the blank is the argmax.
+        Returns the emission (B, T - 4, len(vocab_ids)) and `vocab_ids`.
+        """
+        vocab_ids = torch.unique(
+            torch.cat((yseqs.flatten(), yseqs.new_tensor([self.blank_id])))
+        )
+        emission = ctc_logits[:, 4:, vocab_ids].float().exp()
+        blank_col = int(torch.searchsorted(vocab_ids, self.blank_id))
+        emission[:, :, blank_col].masked_fill_(yseqs[:, 4:] == self.blank_id, 0)
+        return emission, vocab_ids
 
-                align = ctc_forced_align(
-                    logits_speech.unsqueeze(0).float(),
-                    torch.Tensor(token_int[4:]).unsqueeze(0).long().to(logits_speech.device),
-                    (encoder_out_lens-4).long(),
-                    torch.tensor(len(token_int)-4).unsqueeze(0).long().to(logits_speech.device),
-                    ignore_id=self.ignore_id,
-                )
+    def _align_timestamps(self, ctc_logits, yseqs, token_ints, speech_lengths):
+        """[start, end] seconds of every speech token, from one forced alignment of the batch.
 
-                pred = groupby(align[0, :encoder_out_lens[0]])
-                _start = 0
-                token_id = 0
-                ts_max = encoder_out_lens[i] - 4
-                for pred_token, pred_frame in pred:
-                    _end = _start + len(list(pred_frame))
-                    if pred_token != 0:
-                        ts_left = max((_start*60-30)/1000, 0)
-                        ts_right = min((_end*60-30)/1000, (ts_max*60-30)/1000)
-                        timestamp.append([tokens[token_id], ts_left, ts_right])
-                        token_id += 1
-                    _start = _end
-
-                result_i = {"key": key[i], "text": text, "timestamp": timestamp}
-                results.append(result_i)
-            else:
-                result_i = {"key": key[i], "text": text}
-                results.append(result_i)
-        return results, meta_data
+        token_ints: token ids of each item without the 4 rich tags, speech_lengths: frames of
+        each item after the prompt. Targets are packed into one (B, L_max) tensor and every path
+        is read back on its own length.
+        """
+        emission, vocab_ids = self._timestamp_emission(ctc_logits, yseqs)
+        blank_col = int(torch.searchsorted(vocab_ids, self.blank_id))
+        device = vocab_ids.device
+
+        target_lengths = torch.tensor([len(t) for t in token_ints], dtype=torch.long, device=device)
+        targets = torch.full(
+            (len(token_ints), max(int(target_lengths.max()), 1)), blank_col, dtype=torch.long, device=device
+        )
+        flat = torch.tensor([tok for t in token_ints for tok in t], dtype=torch.long, device=device)
+        targets[torch.arange(targets.size(1), device=device)[None, :] < target_lengths[:, None]] = (
+            torch.searchsorted(vocab_ids, flat)
+        )
+        speech_lengths = speech_lengths.long().clamp(min=0).to(device)
+        align = ctc_forced_align(
+            emission,
+            targets,
+            speech_lengths,
+            target_lengths,
+            blank=blank_col,
+            ignore_id=self.ignore_id,
+        ).tolist()
+
+        spans = []
+        for path, ts_max in zip(align, speech_lengths.tolist()):
+            span = []
+            _start = 0
+            for pred_token, pred_frame in groupby(path[:ts_max]):
+                _end = _start + len(list(pred_frame))
+                if pred_token != blank_col:
+                    ts_left = max((_start * 60 - 30) / 1000, 0)
+                    ts_right = min((_end * 60 - 30) / 1000, (ts_max * 60 - 30) / 1000)
+                    span.append([ts_left, ts_right])
+                _start = _end
+            spans.append(span)
+        return spans
+
+    def compile_encoder(self, buckets=(64, 128, 192, 256, 320), mode="trace", warmup=True):
+        """Route `inference` through a `BucketedEncoder`; `mode=None` restores eager mode.
+
+        The runner is not an nn.Module, so it never shows up in the state dict.
+        """
+        if mode is None:
+            self.bucketed_encoder = None
+            return None
+        self.eval()
+        runner = BucketedEncoder(self.encoder, buckets=buckets, mode=mode)
+        if warmup:
+            with torch.no_grad():
+                runner.warmup(self.embed.weight.device, self.embed.weight.dtype)
+        self.bucketed_encoder = runner
+        return runner
+
+    def init_stream_cache(
+        self, language: str = "auto", use_itn: bool = False, chunk_size=(0, 10, 5), look_back: int = -1
+    ):
+        """State of one streaming session, see `inference_chunk`.
+
+        chunk_size: (_, chunk, lookahead) in LFR frames (60ms each), look_back: number of
+        previous chunks kept in the attention cache, -1 keeps the whole history.
+        """
+        assert chunk_size[1] > 0 and chunk_size[2] > 0
+        textnorm = "withitn" if use_itn else "woitn"
+        return {
+            "prompt_index": self.prompt_index(language, textnorm),
+            "encoder": {
+                "chunk_size": list(chunk_size),
+                "look_back": look_back,
+                "start_idx": 0,
+                "layers": None,
+            },
+            "feats": None,
+            "last_token": self.blank_id,
+            "token_int": [],
+        }
+
+    @torch.no_grad()
+    def inference_chunk(
+        self, speech: torch.Tensor, cache: dict, is_final: bool = False, tokenizer=None, **kwargs
+    ):
+        """Streaming greedy CTC decoding on top of `SenseVoiceEncoderSmall.forward_chunk`.
+
+        speech: newly extracted LFR+CMVN features (1, T, D). They are buffered until a full
+        chunk plus its lookahead is available; `is_final` flushes the rest. Returns the
+        hypothesis of everything decoded so far.
+        """
+        device = self.embed.weight.device
+        speech = speech.to(device=device, dtype=self.embed.weight.dtype)
+        if cache["feats"] is not None:
+            speech = torch.cat((cache["feats"], speech), dim=1)
+        _, chunk, lookahead = cache["encoder"]["chunk_size"]
+
+        windows = []
+        while speech.size(1) >= chunk + lookahead:
+            windows.append((speech[:, : chunk + lookahead], chunk))
+            speech = speech[:, chunk:]
+        if is_final and speech.size(1) > 0:
+            windows.append((speech, speech.size(1)))
+            speech = speech[:, :0]
+        cache["feats"] = speech
+
+        for window, num_frames in windows:
+            if cache["encoder"]["start_idx"] == 0:
+                prompt = self.build_prompt_cache(device, window.dtype)[cache["prompt_index"]]
+                window = torch.cat((prompt[None, :, :], window), dim=1)
+                num_frames += prompt.size(0)
+            encoder_out = self.encoder.forward_chunk(window, cache["encoder"])
+            ctc_logits = self.ctc.log_softmax(encoder_out[:, :num_frames])
+            if kwargs.get("ban_emo_unk", False):
+                ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
+            for token in ctc_logits[0].argmax(dim=-1).tolist():
+                if token != cache["last_token"] and token != self.blank_id:
+                    cache["token_int"].append(token)
+                cache["last_token"] = token
+
+        if tokenizer is None:
+            return list(cache["token_int"])
+        return tokenizer.decode(cache["token_int"])
+
+    @torch.no_grad()
+    def build_prompt_cache(self, device=None, dtype=None):
+        """Embed the 4-token prompt prefix for every (language, textnorm) pair.
+
+        Returns a tensor of shape (len(lid_dict) * len(textnorm_dict), 4, input_size),
+        rebuilt only when the device, dtype or the embedding weights change.
+        """
+        weight = self.embed.weight
+        device = weight.device if device is None else torch.device(device)
+        dtype = weight.dtype if dtype is None else dtype
+        cache_key = (str(device), dtype, weight.data_ptr(), weight._version)
+        if getattr(self, "_prompt_cache_key", None) != cache_key:
+            lids = torch.tensor(list(self.lid_dict.values()), dtype=torch.long)
+            textnorms = torch.tensor(list(self.textnorm_dict.values()), dtype=torch.long)
+            n_lid, n_textnorm = lids.numel(), textnorms.numel()
+            prompt_ids = torch.stack(
+                (
+                    lids.repeat_interleave(n_textnorm),
+                    torch.full((n_lid * n_textnorm,), 1, dtype=torch.long),
+                    torch.full((n_lid * n_textnorm,), 2, dtype=torch.long),
+                    textnorms.repeat(n_lid),
+                ),
+                dim=-1,
+            )
+            self._prompt_cache = self.embed(prompt_ids.to(weight.device)).to(
+                device=device, dtype=dtype
+            )
+            self._prompt_cache_key = cache_key
+        return self._prompt_cache
+
+    def prompt_index(self, language: str, textnorm: str) -> int:
+        languages = list(self.lid_dict)
+        lid_idx = languages.index(language) if language in self.lid_dict else languages.index("auto")
+        return lid_idx * len(self.textnorm_dict) + list(self.textnorm_dict).index(textnorm)
 
     def export(self, **kwargs):
         from export_meta import export_rebuild_model
@@ -928,3 +1250,66 @@ class SenseVoiceSmall(nn.Module):
             kwargs["max_seq_len"] = 512
         models = export_rebuild_model(model=self, **kwargs)
         return models
+
+
+# Linear layers of the SANM stack that are replaced by int8 dynamic quantized ones;
+# the embedding, fsmn convolutions, layer norms and the ctc projection stay in float32.
+DYNAMIC_QUANT_LAYERS = ("linear_q_k_v", "linear_out", "feed_forward.w_1", "feed_forward.w_2")
+
+
+def dynamic_quant_targets(model: nn.Module):
+    return [
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and name.endswith(DYNAMIC_QUANT_LAYERS)
+    ]
+
+
+def _swap_dynamic_linear(model: nn.Module, targets):
+    """Replace float Linear layers by empty int8 ones so a quantized state dict can be loaded."""
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantLinear
+
+    for name in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        linear = getattr(parent, child_name)
+        setattr(
+            parent,
+            child_name,
+            DynamicQuantLinear(
+                linear.in_features,
+                linear.out_features,
+                bias_=linear.bias is not None,
+                dtype=torch.qint8,
+            ),
+        )
+
+
+def quantize_dynamic_int8(
+    model: nn.Module, cache_file: Optional[str] = None, source_file: Optional[str] = None
+):
+    """Dynamic int8 quantization of the encoder linear layers for CPU inference.
+
+    The quantized state dict is cached in `cache_file`, later loads only swap in the
+    quantized modules and restore the packed weights instead of re-quantizing. The cache
+    is rebuilt when `source_file` (the float checkpoint) or the torch version changes.
+    """
+    model = model.cpu().eval()
+    targets = dynamic_quant_targets(model)
+    meta = {"targets": targets, "torch": torch.__version__}
+    if source_file is not None and os.path.exists(source_file):
+        stat = os.stat(source_file)
+        meta["source"] = [os.path.abspath(source_file), stat.st_size, stat.st_mtime_ns]
+
+    if cache_file is not None and os.path.exists(cache_file):
+        cache = torch.load(cache_file, map_location="cpu")
+        if cache.get("meta") == meta:
+            _swap_dynamic_linear(model, targets)
+            model.load_state_dict(cache["state_dict"])
+            return model
+
+    torch.ao.quantization.quantize_dynamic(model, set(targets), dtype=torch.qint8, inplace=True)
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        torch.save({"meta": meta, "state_dict": model.state_dict()}, cache_file)
+    return model
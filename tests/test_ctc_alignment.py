@@ -0,0 +1,99 @@
+import random
+
+import pytest
+import torch
+
+from utils import ctc_alignment
+from utils.ctc_alignment import ctc_forced_align
+
+
+def reference_align(log_probs, targets, blank=0):
+    """The original unbanded Viterbi aligner, for a single item of full length."""
+    input_time_size = log_probs.size(1)
+    ext_targets = torch.cat(
+        (
+            torch.stack((torch.full_like(targets, blank), targets), dim=-1).flatten(start_dim=1),
+            torch.full_like(targets[:, :1], blank),
+        ),
+        dim=-1,
+    )
+    diff_labels = torch.cat(
+        (torch.tensor([[False, False]]), ext_targets[:, 2:] != ext_targets[:, :-2]), dim=1
+    )
+    neg_inf = torch.tensor(float("-inf"), dtype=log_probs.dtype)
+    padding_num = 2
+    best_score = torch.full((1, padding_num + ext_targets.size(-1)), neg_inf, dtype=log_probs.dtype)
+    best_score[:, padding_num + 0] = log_probs[:, 0, blank]
+    best_score[:, padding_num + 1] = log_probs[0, 0, ext_targets[0, 1]]
+    backpointers = torch.zeros((1, input_time_size, best_score.size(-1)), dtype=torch.long)
+    for t in range(1, input_time_size):
+        prev = torch.stack(
+            (best_score[:, 2:], best_score[:, 1:-1], torch.where(diff_labels, best_score[:, :-2], neg_inf))
+        )
+        prev_max_value, prev_max_idx = prev.max(dim=0)
+        best_score[:, padding_num:] = log_probs[:, t].gather(-1, ext_targets) + prev_max_value
+        backpointers[:, t, padding_num:] = prev_max_idx
+
+    target_length = targets.size(1)
+    l1l2 = best_score[0, padding_num + target_length * 2 - 1 : padding_num + target_length * 2 + 1]
+    path = torch.zeros(input_time_size, dtype=torch.long)
+    path[-1] = padding_num + target_length * 2 - 1 + l1l2.argmax()
+    for t in range(input_time_size - 1, 0, -1):
+        path[t - 1] = path[t] - backpointers[0, t, path[t]]
+    return ext_targets[0, path - padding_num]
+
+
+def random_batch(rng, ties):
+    batch_size, num_classes = rng.randint(1, 5), rng.randint(2, 8)
+    input_time_size, max_target = rng.randint(1, 40), rng.randint(1, 12)
+    input_lengths = torch.tensor([rng.randint(1, input_time_size) for _ in range(batch_size)])
+    input_lengths[0] = input_time_size
+    target_lengths = torch.tensor([rng.randint(1, max_target) for _ in range(batch_size)])
+    targets = torch.randint(1, num_classes, (batch_size, max_target))
+    log_probs = torch.randn(batch_size, input_time_size, num_classes)
+    if ties:
+        log_probs = log_probs.round()
+    return log_probs, targets, input_lengths, target_lengths
+
+
+def feasible(targets, input_length):
+    return input_length >= len(targets) + sum(a == b for a, b in zip(targets[1:], targets[:-1]))
+
+
+@pytest.mark.parametrize("backend", ["viterbi", "auto"])
+@pytest.mark.parametrize("ties", [False, True])
+def test_matches_reference(backend, ties):
+    if backend == "auto" and ties:
+        pytest.skip("backends may pick different paths when scores tie exactly")
+    rng = random.Random(0)
+    torch.manual_seed(0)
+    for _ in range(300):
+        log_probs, targets, input_lengths, target_lengths = random_batch(rng, ties)
+        align = ctc_forced_align(log_probs, targets, input_lengths, target_lengths, backend=backend)
+        for b in range(log_probs.size(0)):
+            input_length, target = int(input_lengths[b]), targets[b, : target_lengths[b]]
+            if not feasible(target.tolist(), input_length):
+                continue
+            expected = reference_align(log_probs[b : b + 1, :input_length], target[None, :])
+            assert torch.equal(align[b, :input_length], expected)
+            assert (align[b, input_length:] == 0).all()
+
+
+def test_auto_mixes_backends():
+    if ctc_alignment._torchaudio_forced_align is None:
+        pytest.skip("torchaudio.functional.forced_align is not available")
+    torch.manual_seed(0)
+    log_probs = torch.randn(3, 20, 6).log_softmax(-1)
+    # the second target holds a blank and the third one is empty: both go through the loop
+    targets = torch.tensor([[1, 2, 3], [4, 0, 5], [1, 1, 1]])
+    input_lengths = torch.tensor([20, 18, 15])
+    target_lengths = torch.tensor([3, 3, 0])
+    align = ctc_forced_align(log_probs, targets, input_lengths, target_lengths)
+    expected = ctc_forced_align(log_probs, targets, input_lengths, target_lengths, backend="viterbi")
+    assert torch.equal(align, expected)
+
+
+def test_ignore_id_is_not_modified_in_place():
+    targets = torch.tensor([[1, 2, -1]])
+    ctc_forced_align(torch.randn(1, 8, 3), targets, torch.tensor([8]), torch.tensor([2]))
+    assert targets.tolist() == [[1, 2, -1]]
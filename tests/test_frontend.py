@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from utils.frontend import WavFrontend, WavFrontendOnline
+
+# knf computes in float32, the numpy fbank's FFT and power spectrum in float64
+FBANK_ATOL = 1e-3
+
+
+def waveforms():
+    rng = np.random.default_rng(0)
+    t = np.arange(16000 * 3) / 16000
+    yield (rng.standard_normal(16000 * 3) * 0.3).astype(np.float32)
+    yield (rng.standard_normal(16000 * 2) * 1e-4).astype(np.float32)
+    # a pure tone leaves most mel bins with very little energy
+    yield (0.8 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    yield np.zeros(16000, dtype=np.float32)
+    yield np.zeros(300, dtype=np.float32)
+
+
+@pytest.mark.parametrize("waveform", list(waveforms()))
+def test_numpy_fbank_matches_knf(waveform):
+    expected, expected_len = WavFrontend(dither=0.0, fbank_impl="knf").fbank(waveform)
+    feat, feat_len = WavFrontend(dither=0.0, fbank_impl="numpy").fbank(waveform)
+    assert feat.shape == expected.shape and feat_len == expected_len
+    np.testing.assert_allclose(feat, expected, rtol=0, atol=FBANK_ATOL)
+
+
+@pytest.mark.parametrize("chunk", [160, 1234, 9600])
+def test_online_numpy_fbank_matches_knf(chunk):
+    waveform = next(waveforms())
+    outputs = {}
+    for impl in ("numpy", "knf"):
+        frontend = WavFrontendOnline(dither=0.0, lfr_m=7, lfr_n=6, fbank_impl=impl)
+        feats, wavs = [], []
+        for beg in range(0, len(waveform), chunk):
+            is_final = beg + chunk >= len(waveform)
+            part = waveform[beg : beg + chunk]
+            feat, _ = frontend.extract_fbank(part[None, :], np.array([len(part)]), is_final)
+            if feat.size:
+                feats.append(feat[0])
+                wavs.append(frontend.get_waveforms().copy())
+        outputs[impl] = np.concatenate(feats), wavs
+    feat, wavs = outputs["numpy"]
+    expected, expected_wavs = outputs["knf"]
+    assert feat.shape == expected.shape
+    np.testing.assert_allclose(feat, expected, rtol=0, atol=FBANK_ATOL)
+    assert all(np.array_equal(a, b) for a, b in zip(wavs, expected_wavs))
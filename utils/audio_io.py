@@ -0,0 +1,364 @@
+# -*- encoding: utf-8 -*-
+
+import math
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import soundfile as sf
+
+# how far before the end of the audio it has seen the streaming VAD may still place a segment start
+VAD_LOOKBACK_MS = 3000
+
+
+_resampler_registry = {}
+_resampler_lock = threading.Lock()
+
+
+def polyphase_filter(up: int, down: int, half_len: int = None, beta: float = 5.0) -> np.ndarray:
+    """Kaiser-windowed sinc low-pass of `scipy.signal.resample_poly` for an up/down ratio,
+    with gain `up` so the zero-stuffed signal keeps its level."""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate if half_len is None else half_len
+    cutoff = 1.0 / max_rate
+    m = np.arange(2 * half_len + 1) - half_len
+    h = cutoff * np.sinc(cutoff * m) * np.kaiser(2 * half_len + 1, beta)
+    return h / h.sum() * up
+
+
+class ResampleKernel:
+    """
+    Polyphase decomposition of the `resample_poly` filter for one rate pair.
+
+    Output sample n reads the `taps` input samples ending at `(n * down + delay) // up`,
+    weighted by `phases[(n * down + delay) % up]`.
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int):
+        g = math.gcd(int(src_rate), int(dst_rate))
+        self.up, self.down = int(dst_rate) // g, int(src_rate) // g
+        h = polyphase_filter(self.up, self.down)
+        self.delay = (len(h) - 1) // 2
+        self.taps = -(-len(h) // self.up)
+        padded = np.zeros(self.taps * self.up)
+        padded[: len(h)] = h
+        # phases[p, j] multiplies input x[i - taps + 1 + j] for output phase p
+        self.phases = np.ascontiguousarray(padded.reshape(self.taps, self.up).T[:, ::-1], dtype=np.float32)
+        self.phases.flags.writeable = False
+
+    def num_output(self, num_input: int) -> int:
+        return -(-num_input * self.up // self.down)
+
+    def newest(self, n):
+        """Stream index of the newest input sample output `n` reads."""
+        return (n * self.down + self.delay) // self.up
+
+    def apply(self, x: np.ndarray, x_base: int, n0: int, out: np.ndarray):
+        """Outputs n0, n0 + 1, ... into `out`, where x[i] is input sample x_base + i and holds
+        every sample those outputs read."""
+        windows = np.lib.stride_tricks.sliding_window_view(x, self.taps)
+        for r in range(min(self.up, len(out))):
+            # outputs n, n + up, n + 2 up, ... share a phase and read windows `down` apart
+            n = n0 + r
+            dst = out[r :: self.up]
+            first = self.newest(n) - x_base - self.taps + 1
+            rows = windows[first : first + (len(dst) - 1) * self.down + 1 : self.down]
+            np.matmul(rows, self.phases[(n * self.down + self.delay) % self.up], out=dst)
+
+
+def get_resample_kernel(src_rate: int, dst_rate: int) -> ResampleKernel:
+    """Kernel for a rate pair, designed once per process and shared by all resamplers."""
+    key = (int(src_rate), int(dst_rate))
+    with _resampler_lock:
+        kernel = _resampler_registry.get(key)
+        if kernel is None:
+            kernel = _resampler_registry[key] = ResampleKernel(*key)
+        return kernel
+
+
+def resample(waveform: np.ndarray, src_rate: int, dst_rate: int = 16000, out: np.ndarray = None) -> np.ndarray:
+    """
+    `scipy.signal.resample_poly` of a float32 waveform with a cached kernel, written into
+    `out` (float32, `ResampleKernel.num_output(len(waveform))` samples) when given. Only the
+    filter-length edges are copied; the rest is read from `waveform` in place.
+    """
+    waveform = np.asarray(waveform, dtype=np.float32)
+    if int(src_rate) == int(dst_rate):
+        if out is None:
+            return waveform
+        out[:] = waveform
+        return out
+    kernel = get_resample_kernel(src_rate, dst_rate)
+    total = kernel.num_output(len(waveform))
+    if out is None:
+        out = np.empty(total, dtype=np.float32)
+    # outputs whose inputs all lie inside the waveform
+    lo = min(total, max(0, -(-((kernel.taps - 1) * kernel.up - kernel.delay) // kernel.down)))
+    hi = max(lo, min(total, (len(waveform) * kernel.up - 1 - kernel.delay) // kernel.down + 1))
+    if hi > lo:
+        kernel.apply(waveform, 0, lo, out[lo:hi])
+    for beg, end in ((0, lo), (hi, total)):
+        if end > beg:
+            first = kernel.newest(beg) - kernel.taps + 1
+            last = kernel.newest(end - 1)
+            edge = np.zeros(last - first + 1, dtype=np.float32)
+            src = slice(max(first, 0), min(last + 1, len(waveform)))
+            edge[src.start - first : src.stop - first] = waveform[src]
+            kernel.apply(edge, first, beg, out[beg:end])
+    return out
+
+
+class StreamingResampler:
+    """
+    Polyphase FIR resampler that keeps its state between blocks.
+
+    Feeding a signal block by block gives the same output as `resample` (and
+    `scipy.signal.resample_poly`) on the whole signal. Only `taps - 1` input samples are kept
+    between blocks; the kernel comes from the process-wide registry.
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int):
+        self.kernel = get_resample_kernel(src_rate, dst_rate)
+        self.passthrough = int(src_rate) == int(dst_rate)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.kernel.taps - 1, dtype=np.float32)
+        self.num_in = 0
+        self.num_out = 0
+
+    def process(self, block: np.ndarray, final: bool = False) -> np.ndarray:
+        """Resample the next block; `final` flushes the filter tail after it."""
+        block = np.asarray(block, dtype=np.float32)
+        if self.passthrough:
+            self.num_in += len(block)
+            self.num_out += len(block)
+            return block
+        kernel = self.kernel
+        x = np.concatenate((self.history, block))
+        base = self.num_in - (kernel.taps - 1)  # stream index of x[0]
+        self.num_in += len(block)
+
+        if final:
+            end = kernel.num_output(self.num_in)
+            last_needed = kernel.newest(end - 1) if end else 0
+            x = np.concatenate((x, np.zeros(max(0, last_needed - self.num_in + 1), dtype=np.float32)))
+        else:
+            # every output whose newest input sample has arrived, so the next block never
+            # reaches further back than the history kept
+            end = max(self.num_out, (self.num_in * kernel.up - 1 - kernel.delay) // kernel.down + 1)
+        out = np.empty(end - self.num_out, dtype=np.float32)
+        if len(out):
+            kernel.apply(x, base, self.num_out, out)
+        self.num_out = end
+        if final:
+            self.reset()
+        else:
+            self.history = x[len(x) - (kernel.taps - 1) :].copy()
+        return out
+
+
+def _decode_blocks(path: Union[str, Path], fs: int, frames: int) -> Iterator[Tuple[np.ndarray, int]]:
+    """(mono float32 block, sample rate) pairs from libsndfile, or ffmpeg at `fs` otherwise."""
+    try:
+        info = sf.info(str(path))
+    except RuntimeError:
+        info = None
+    if info is not None:
+        for block in sf.blocks(str(path), blocksize=frames, dtype="float32", always_2d=True):
+            yield (block[:, 0] if block.shape[1] == 1 else block.mean(axis=1)), info.samplerate
+        return
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"cannot decode {path}: not supported by libsndfile and ffmpeg is not installed")
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", str(path), "-f", "f32le", "-ac", "1", "-ar", str(fs), "-"]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(frames * 4)
+            if not data:
+                break
+            yield np.frombuffer(data[: len(data) - len(data) % 4], dtype="<f4"), fs
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}")
+
+
+def iter_audio_blocks(path: Union[str, Path], fs: int = 16000, block_size: int = 16000 * 10) -> Iterator[np.ndarray]:
+    """
+    Mono float32 audio at `fs` in blocks of exactly `block_size` samples (the last one may
+    be shorter), decoded and resampled block by block so memory does not grow with the file.
+    """
+    pending = np.empty(block_size, dtype=np.float32)
+    filled = 0
+    resampler = None
+
+    def fill(samples):
+        nonlocal filled
+        while len(samples):
+            take = min(block_size - filled, len(samples))
+            pending[filled : filled + take] = samples[:take]
+            filled += take
+            samples = samples[take:]
+            if filled == block_size:
+                filled = 0
+                yield pending.copy()
+
+    for block, rate in _decode_blocks(path, fs, block_size):
+        if resampler is None and rate != fs:
+            resampler = StreamingResampler(rate, fs)
+        yield from fill(resampler.process(block) if resampler is not None else block)
+    if resampler is not None:
+        yield from fill(resampler.process(np.zeros(0, dtype=np.float32), final=True))
+    if filled:
+        yield pending[:filled].copy()
+
+
+def read_audio(path: Union[str, Path], fs: int = 16000, block_size: int = 16000 * 10) -> np.ndarray:
+    """Whole file as mono float32 at `fs`, decoded block-wise into one preallocated array
+    when the length is known up front, so no full-length intermediate copies are made."""
+    try:
+        info = sf.info(str(path))
+    except RuntimeError:
+        info = None
+    if info is None or info.frames <= 0:
+        return np.concatenate(list(iter_audio_blocks(path, fs, block_size)) or [np.zeros(0, dtype=np.float32)])
+
+    g = math.gcd(int(info.samplerate), fs)
+    total = -(-info.frames * (fs // g) // (info.samplerate // g))
+    out = np.empty(total, dtype=np.float32)
+    pos = 0
+    for block in iter_audio_blocks(path, fs, block_size):
+        out[pos : pos + len(block)] = block
+        pos += len(block)
+    return out[:pos]
+
+
+class SampleWindow:
+    """The most recent part of a sample stream, addressed by stream index, with the samples
+    before `drop_before` released; backs segment extraction from audio read block by block."""
+
+    def __init__(self, capacity: int = 16000 * 60):
+        self.buffer = np.empty(capacity, dtype=np.float32)
+        self.offset = 0  # stream index of buffer[0]
+        self.end = 0  # stream index after the last sample
+
+    def append(self, samples: np.ndarray):
+        used = self.end - self.offset
+        if used + len(samples) > len(self.buffer):
+            grown = np.empty(max(2 * len(self.buffer), used + len(samples)), dtype=np.float32)
+            grown[:used] = self.buffer[:used]
+            self.buffer = grown
+        self.buffer[used : used + len(samples)] = samples
+        self.end += len(samples)
+
+    def slice(self, beg: int, end: int) -> np.ndarray:
+        """Copy of stream samples [beg, end), clipped to what is kept."""
+        beg, end = max(beg, self.offset), min(end, self.end)
+        return self.buffer[beg - self.offset : max(beg, end) - self.offset].copy()
+
+    def drop_before(self, index: int):
+        drop = min(max(0, index - self.offset), self.end - self.offset)
+        if drop:
+            used = self.end - self.offset
+            self.buffer[: used - drop] = self.buffer[drop:used]
+            self.offset += drop
+
+
+def merge_vad(vad_result: List[List[int]], max_length: int = 15000, min_length: int = 0) -> List[List[int]]:
+    """`funasr.utils.vad_utils.merge_vad` without funasr: starting from 0, each span is cut at the
+    last segment boundary before it would exceed `max_length` (ms)."""
+    if len(vad_result) <= 1:
+        return vad_result
+    time_step = sorted(set([t[0] for t in vad_result] + [t[1] for t in vad_result]))
+    new_result = []
+    bg = 0
+    for i in range(len(time_step) - 1):
+        if time_step[i + 1] - bg < max_length:
+            continue
+        if time_step[i] - bg > min_length:
+            new_result.append([bg, time_step[i]])
+        bg = time_step[i]
+    new_result.append([bg, time_step[-1]])
+    return new_result
+
+
+class StreamingVadMerger:
+    """
+    `merge_vad` applied to VAD segments as they arrive.
+
+    Spans are emitted as soon as no later segment can change them. Spans that contain no
+    speech (the gaps merge_vad emits across long silences) are dropped, which also lets
+    `keep_from` move past long silences so the audio kept stays bounded. Unlike merge_vad, a
+    single segment is merged like any other, since whether more follow is not known yet.
+    """
+
+    def __init__(self, max_length: int = 15000, min_length: int = 0, lookback: int = VAD_LOOKBACK_MS):
+        self.max_length = max_length
+        self.min_length = min_length
+        self.lookback = lookback
+        self.bg = 0
+        self.pending = None
+        self.last_point = None
+        self.silent = False
+        self.segments: List[List[int]] = []
+        self.now = 0
+
+    def push(self, beg: int, end: int) -> List[List[int]]:
+        """Add a finished VAD segment (ms), returns the spans this completes."""
+        self.segments.append([beg, end])
+        spans = []
+        for point in (beg, end):
+            if point == self.last_point:
+                continue
+            self.last_point = point
+            if self.silent:
+                # the span from bg ends at this segment start and holds no speech
+                self.silent = False
+                self.bg = point
+                continue
+            if self.pending is not None and point - self.bg >= self.max_length:
+                spans += self._emit(self.pending)
+                self.bg = self.pending
+            self.pending = point
+        return spans
+
+    def advance(self, now: int, open_beg: int = None) -> List[List[int]]:
+        """The VAD has seen audio up to `now` ms, with a segment started at `open_beg` still open.
+        Without an open segment, later segments can only start after `now - lookback`, which
+        may settle the span in progress."""
+        self.now = now
+        spans = []
+        if open_beg is not None:
+            if self.silent:
+                # the start of this segment ends the span without speech, as in `push`
+                self.silent = False
+                self.bg = self.last_point = open_beg
+            return spans
+        if now - self.lookback - self.bg < self.max_length:
+            return spans
+        if self.pending is not None:
+            spans += self._emit(self.pending)
+            self.bg = self.pending
+            self.pending = None
+        else:
+            self.silent = True
+        return spans
+
+    def finish(self) -> List[List[int]]:
+        if self.pending is None or self.silent:
+            return []
+        return self._emit(self.pending)
+
+    def keep_from(self) -> int:
+        """Earliest time (ms) a span emitted later can start at."""
+        return self.now - self.lookback if self.silent else self.bg
+
+    def _emit(self, time: int) -> List[List[int]]:
+        span = [self.bg, time]
+        speech = any(beg < time and end > self.bg for beg, end in self.segments)
+        self.segments = [s for s in self.segments if s[1] > time]
+        if time - self.bg <= self.min_length or not speech:
+            return []
+        return [span]
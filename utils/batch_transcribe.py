@@ -0,0 +1,250 @@
+# -*- encoding: utf-8 -*-
+
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, List, Set, Tuple, Union
+
+import numpy as np
+
+from utils.audio_io import read_audio
+from utils.infer_utils import get_logger
+from utils.onnx_backend import vad_segments
+
+logging = get_logger()
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+
+def iter_inputs(source: Union[str, Path]) -> Iterator[Tuple[str, str]]:
+    """
+    (key, path) pairs to transcribe, lazily, from
+    - a directory: audio files below it, keyed by their path relative to it
+    - a JSONL manifest: one {"key": ..., "source": path} object per line ("audio" is accepted
+      for "source"; the path is the key when "key" is missing), relative paths are resolved
+      against the manifest's directory; a line that is not such an object is logged and
+      yielded with path None, keyed by its "key" or "<manifest>:<line number>"
+    - a glob pattern: matching audio files, keyed by path
+    """
+    source = str(source)
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, source), path
+    elif source.endswith(".jsonl") and os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    item, error = None, f"invalid JSON ({e})"
+                else:
+                    error = None if isinstance(item, dict) else "not a JSON object"
+                path = item.get("source", item.get("audio")) if error is None else None
+                if error is None and not isinstance(path, str):
+                    error = 'no "source" or "audio" path'
+                if error is not None:
+                    logging.warning(f"{source}:{lineno}: {error}")
+                    key = item.get("key") if isinstance(item, dict) else None
+                    yield str(key if key is not None else f"{source}:{lineno}"), None
+                    continue
+                yield str(item.get("key", path)), os.path.join(base, path)
+    else:
+        for path in sorted(glob.glob(source, recursive=True)):
+            if path.lower().endswith(AUDIO_EXTENSIONS):
+                yield path, path
+
+
+def load_checkpoint(output: Union[str, Path]) -> Set[str]:
+    """
+    Keys already transcribed into the JSONL `output`. Files that failed are retried, so their
+    error records are dropped here along with a line cut short by an interrupted run; the
+    output then holds one record per key (if a key is listed twice, its last record wins).
+    Lines that are not a JSON object with a "key" are logged and dropped.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    kept, compact = [], False
+    with open(output, "rb") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.endswith(b"\n"):
+                # torn last line of an interrupted run, nothing after it was written
+                compact = True
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict) or "key" not in record:
+                logging.warning(f"{output}:{lineno}: not a transcript record, dropped")
+                compact = True
+            elif "text" in record:
+                done.add(str(record["key"]))
+                kept.append(line)
+            else:
+                compact = True
+    if compact:
+        tmp = f"{output}.tmp"
+        with open(tmp, "wb") as f:
+            f.writelines(kept)
+        os.replace(tmp, output)
+    return done
+
+
+class SenseVoiceTorchPipeline:
+    """
+    The `segment` / `recognize` pair of `SenseVoiceONNXPipeline` on FunASR torch models: the VAD
+    and SenseVoiceSmall are separate AutoModels so segments of several files go through the
+    model in one batch.
+    """
+
+    def __init__(
+        self,
+        model_dir: Union[str, Path],
+        vad_model_dir: Union[str, Path],
+        device: str = "cuda:0",
+        max_single_segment_time: int = 30000,
+        batch_size: int = 16,
+    ):
+        from funasr import AutoModel
+
+        self.asr = AutoModel(
+            model=model_dir, trust_remote_code=True, remote_code="./model.py", device=device, disable_update=True
+        )
+        self.vad = AutoModel(
+            model=vad_model_dir,
+            max_single_segment_time=max_single_segment_time,
+            device=device,
+            disable_pbar=True,
+            disable_update=True,
+        )
+        self.batch_size = batch_size
+        self.fs = 16000
+
+    def segment(self, waveform: np.ndarray, merge_vad: bool = True, merge_length_s: int = 15) -> List[np.ndarray]:
+        return vad_segments(self.vad, waveform, self.fs, merge_vad, merge_length_s)
+
+    def recognize(self, segments: List[np.ndarray], language: str = "auto", use_itn: bool = False) -> List[str]:
+        # batch segments of similar length together to keep padding small
+        order = sorted(range(len(segments)), key=lambda i: len(segments[i]))
+        res = self.asr.generate(
+            input=[segments[i] for i in order],
+            cache={},
+            language=language,
+            use_itn=use_itn,
+            batch_size=self.batch_size,
+            disable_pbar=True,
+        )
+        texts = [""] * len(segments)
+        for i, r in zip(order, res):
+            texts[i] = r["text"]
+        return texts
+
+
+def transcribe_files(
+    model,
+    items: Iterator[Tuple[str, str]],
+    output: Union[str, Path],
+    workers: int = 4,
+    batch_size: int = 16,
+    language: str = "auto",
+    use_itn: bool = True,
+    merge_length_s: int = 15,
+    postprocess: Callable[[str], str] = None,
+) -> dict:
+    """
+    Transcribe (key, path) items into the JSONL `output`, resuming after the keys it already has.
+
+    `workers` threads decode and resample files ahead of the model; VAD segments of consecutive
+    files are collected until there are `batch_size` of them and recognized together. Each
+    file's record is appended and flushed as soon as its batch is done:
+    {"key", "source", "duration", "text"} plus "plain_text" with `postprocess`, or
+    {"key", "source", "error"} when the file could not be transcribed, which the next run
+    replaces (see `load_checkpoint`).
+    """
+    done = load_checkpoint(output)
+    if done:
+        logging.info(f"resuming: {len(done)} files already in {output}")
+    todo = ((key, path) for key, path in items if key not in done)
+    fs = int(getattr(model, "fs", 16000))
+    stats = {"files": 0, "errors": 0, "audio_s": 0.0}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(output, "a", encoding="utf-8") as out:
+        decoding = deque()
+
+        def prefetch():
+            # a few files per worker in flight keeps the workers busy without holding many waveforms
+            while len(decoding) < 2 * workers:
+                item = next(todo, None)
+                if item is None:
+                    return
+                if item[1] is None:
+                    write({"key": item[0], "source": None, "error": "invalid manifest line"})
+                    continue
+                decoding.append((*item, pool.submit(read_audio, item[1], fs)))
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if "error" in record:
+                stats["errors"] += 1
+                logging.warning(f"{record['source'] or record['key']}: {record['error']}")
+
+        def recognize(group):
+            segments = [s for _, _, _, file_segments in group for s in file_segments]
+            try:
+                texts = iter(model.recognize(segments, language, use_itn) if segments else [])
+            except Exception as e:
+                for key, path, _, _ in group:
+                    write({"key": key, "source": path, "error": f"{type(e).__name__}: {e}"})
+                return
+            for key, path, duration, file_segments in group:
+                text = " ".join(next(texts) for _ in file_segments)
+                record = {"key": key, "source": path, "duration": round(duration, 3), "text": text}
+                if postprocess is not None:
+                    record["plain_text"] = postprocess(text)
+                write(record)
+                stats["files"] += 1
+                stats["audio_s"] += duration
+            out.flush()
+            elapsed = time.perf_counter() - start
+            logging.info(
+                f"{stats['files']} files, {stats['audio_s'] / 3600:.2f} h audio, "
+                f"{elapsed:.0f}s, RTF {elapsed / max(stats['audio_s'], 1e-6):.4f}"
+            )
+
+        prefetch()
+        group, num_segments = [], 0
+        try:
+            while decoding:
+                key, path, future = decoding.popleft()
+                prefetch()
+                try:
+                    waveform = future.result()
+                    file_segments = [s for s in model.segment(waveform, True, merge_length_s) if len(s)]
+                except Exception as e:
+                    write({"key": key, "source": path, "error": f"{type(e).__name__}: {e}"})
+                    continue
+                group.append((key, path, len(waveform) / fs, file_segments))
+                num_segments += len(file_segments)
+                if num_segments >= batch_size:
+                    recognize(group)
+                    group, num_segments = [], 0
+            if group:
+                recognize(group)
+        finally:
+            out.flush()
+            pool.shutdown(wait=True, cancel_futures=True)
+    stats["elapsed_s"] = time.perf_counter() - start
+    return stats
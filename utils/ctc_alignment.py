@@ -1,5 +1,12 @@
+import numpy as np
 import torch
 
+try:
+    from torchaudio.functional import forced_align as _torchaudio_forced_align
+except (ImportError, AttributeError):
+    _torchaudio_forced_align = None
+
+
 def ctc_forced_align(
     log_probs: torch.Tensor,
     targets: torch.Tensor,
@@ -7,6 +14,7 @@ def ctc_forced_align(
     target_lengths: torch.Tensor,
     blank: int = 0,
     ignore_id: int = -1,
+    backend: str = "auto",
 ) -> torch.Tensor:
     """Align a CTC label sequence to an emission.
 
@@ -22,55 +30,174 @@ def ctc_forced_align(
             Lengths of the targets. 1-D Tensor of shape `(B,)`.
         blank_id (int, optional): The index of blank symbol in CTC emission. (Default: 0)
         ignore_id (int, optional): The index of ignore symbol in CTC emission. (Default: -1)
+        backend (str, optional): "auto" (default) aligns every item `torchaudio` can take
+            with `torchaudio.functional.forced_align` and the rest (empty or unalignable
+            targets, blank inside a target, no torchaudio) with the batched "viterbi" loop.
+            Both give the same path unless two candidate paths have exactly the same score.
+
+    Returns:
+        Tensor: Label of every frame, `(B, T)`, frames after an input length are blank.
     """
-    targets[targets == ignore_id] = blank
+    targets = targets.masked_fill(targets == ignore_id, blank)
+    if backend not in ("auto", "viterbi", "torchaudio"):
+        raise ValueError(f"Unknown forced-align backend: {backend}")
+    if backend != "viterbi" and _torchaudio_forced_align is not None:
+        native = _torchaudio_items(targets, input_lengths, target_lengths, blank)
+        if backend == "torchaudio" or native.all():
+            return _forced_align_torchaudio(log_probs, targets, input_lengths, target_lengths, blank)
+        if native.any():
+            alignments = torch.full(
+                log_probs.shape[:2], blank, device=log_probs.device, dtype=targets.dtype
+            )
+            for items, align in (
+                (native, _forced_align_torchaudio), (~native, _forced_align_viterbi)
+            ):
+                index = items.nonzero().squeeze(-1)
+                alignments[index] = align(
+                    log_probs[index], targets[index], input_lengths[index], target_lengths[index], blank
+                ).to(alignments.device)
+            return alignments
+    return _forced_align_viterbi(log_probs, targets, input_lengths, target_lengths, blank)
+
 
+def _forced_align_viterbi(log_probs, targets, input_lengths, target_lengths, blank):
+    """Batched Viterbi over the extended label sequence, one fused step per frame."""
     batch_size, input_time_size, _ = log_probs.size()
-    bsz_indices = torch.arange(batch_size, device=input_lengths.device)
+    if targets.size(1) == 0:
+        return torch.full(
+            (batch_size, input_time_size), blank, device=log_probs.device, dtype=targets.dtype
+        )
 
-    _t_a_r_g_e_t_s_ = torch.cat(
+    # extended label sequence: blank, y1, blank, y2, ..., yL, blank
+    ext_targets = torch.cat(
         (
             torch.stack((torch.full_like(targets, blank), targets), dim=-1).flatten(start_dim=1),
             torch.full_like(targets[:, :1], blank),
         ),
         dim=-1,
     )
-    diff_labels = torch.cat(
-        (
-            torch.as_tensor([[False, False]], device=targets.device).expand(batch_size, -1),
-            _t_a_r_g_e_t_s_[:, 2:] != _t_a_r_g_e_t_s_[:, :-2],
-        ),
-        dim=1,
-    )
-
-    neg_inf = torch.tensor(float("-inf"), device=log_probs.device, dtype=log_probs.dtype)
+    num_states = ext_targets.size(-1)
+    neg_inf = float("-inf")
+    # scores are kept in reverse state order, j = S-1-s, behind two -inf padding states, so the
+    # window starting at j holds (stay, step, skip) = (s, s-1, s-2) and a max over it returns
+    # the lowest move on ties, as the unrolled comparison did
     padding_num = 2
-    padded_t = padding_num + _t_a_r_g_e_t_s_.size(-1)
-    best_score = torch.full((batch_size, padded_t), neg_inf, device=log_probs.device, dtype=log_probs.dtype)
-    best_score[:, padding_num + 0] = log_probs[:, 0, blank]
-    best_score[:, padding_num + 1] = log_probs[bsz_indices, 0, _t_a_r_g_e_t_s_[:, 1]]
+    rev_targets = ext_targets.flip(-1)
+    penalty = torch.zeros((batch_size, 3, num_states), device=log_probs.device, dtype=log_probs.dtype)
+    # -inf where the s-2 -> s skip is not allowed
+    penalty[:, 2] = neg_inf
+    penalty[:, 2, :-2].masked_fill_(rev_targets[:, :-2] != rev_targets[:, 2:], 0.0)
+    emissions = log_probs.gather(-1, rev_targets[:, None, :].expand(-1, input_time_size, -1))
+
+    bands = _feasible_bands(targets, input_lengths, target_lengths, input_time_size, num_states)
 
-    backpointers = torch.zeros((batch_size, input_time_size, padded_t), device=log_probs.device, dtype=targets.dtype)
+    best_score = torch.full(
+        (batch_size, num_states + padding_num), neg_inf, device=log_probs.device, dtype=log_probs.dtype
+    )
+    best_score[:, num_states - 1] = emissions[:, 0, num_states - 1]
+    best_score[:, num_states - 2] = emissions[:, 0, num_states - 2]
+    # windows[b, k, j] = best_score[b, j + k]
+    windows = best_score.as_strided((batch_size, 3, num_states), (num_states + padding_num, 1, 1))
+    backpointers = torch.zeros(
+        (batch_size, input_time_size, num_states), device=log_probs.device, dtype=torch.int8
+    )
+    max_value = torch.empty((batch_size, num_states), device=log_probs.device, dtype=log_probs.dtype)
+    max_idx = torch.empty((batch_size, num_states), device=log_probs.device, dtype=torch.long)
 
+    # the final states of every item are scored at its own last frame, not at the batch's
+    final_index = torch.stack((num_states - target_lengths * 2, num_states - 1 - target_lengths * 2), dim=-1)
+    final_score = torch.zeros_like(final_index, dtype=log_probs.dtype)
+    ends = [None] * input_time_size
+    for b, length in enumerate(input_lengths.tolist()):
+        if 0 < length <= input_time_size:
+            ends[length - 1] = (ends[length - 1] or []) + [b]
+    ends = [None if items is None else torch.as_tensor(items, device=log_probs.device) for items in ends]
+
+    if ends[0] is not None:
+        final_score[ends[0]] = best_score[ends[0]].gather(-1, final_index[ends[0]])
     for t in range(1, input_time_size):
-        prev = torch.stack(
-            (best_score[:, 2:], best_score[:, 1:-1], torch.where(diff_labels, best_score[:, :-2], neg_inf))
-        )
-        prev_max_value, prev_max_idx = prev.max(dim=0)
-        best_score[:, padding_num:] = log_probs[:, t].gather(-1, _t_a_r_g_e_t_s_) + prev_max_value
-        backpointers[:, t, padding_num:] = prev_max_idx
+        lo, hi = num_states - bands[t][1], num_states - bands[t][0]
+        if lo >= hi:
+            continue
+        value, idx = max_value[:, : hi - lo], max_idx[:, : hi - lo]
+        torch.max(windows[:, :, lo:hi] + penalty[:, :, lo:hi], dim=1, out=(value, idx))
+        torch.add(value, emissions[:, t, lo:hi], out=best_score[:, lo:hi])
+        backpointers[:, t, lo:hi] = idx
+        if ends[t] is not None:
+            final_score[ends[t]] = best_score[ends[t]].gather(-1, final_index[ends[t]])
 
-    l1l2 = best_score.gather(
-        -1, torch.stack((padding_num + target_lengths * 2 - 1, padding_num + target_lengths * 2), dim=-1)
-    )
+    # an empty target has only the final blank, reached from the -inf padding slot
+    final_states = (target_lengths * 2 - 1 + final_score.argmax(dim=-1)).clamp(min=0)
+
+    path = _backtrack(backpointers, final_states, input_lengths)
+    alignments = ext_targets.gather(dim=-1, index=path.to(ext_targets.device))
+    return alignments
+
+
+def _feasible_bands(targets, input_lengths, target_lengths, input_time_size, num_states):
+    """Range [lo, hi) of extended states worth updating at every frame of the batch.
+
+    A state above 2t+1 cannot be reached yet and one below 2L-1 - 2(T_i-1-t) cannot reach
+    the final states any more; neither can lie on the best path, so skipping them leaves the
+    path unchanged. Items without any valid path keep the full range.
+    """
+    repeats = ((targets[:, 1:] == targets[:, :-1]) & (
+        torch.arange(1, targets.size(1), device=targets.device)[None, :] < target_lengths[:, None]
+    )).sum(dim=1)
+    feasible = input_lengths.to(targets.device) >= target_lengths + repeats
+
+    t = torch.arange(input_time_size, device=targets.device)
+    lower = (target_lengths[:, None] * 2 - 1) - 2 * (input_lengths.to(targets.device)[:, None] - 1 - t[None, :])
+    lower = torch.where(feasible[:, None], lower, torch.zeros_like(lower))
+    lower = lower.clamp(min=0).min(dim=0).values.clamp(max=num_states)
+    upper = (2 * t + 2).clamp(max=num_states)
+    lower = torch.minimum(lower, upper)
+    return list(zip(lower.tolist(), upper.tolist()))
 
-    path = torch.zeros((batch_size, input_time_size), device=best_score.device, dtype=torch.long)
-    path[bsz_indices, input_lengths - 1] = padding_num + target_lengths * 2 - 1 + l1l2.argmax(dim=-1)
 
+def _backtrack(backpointers, final_states, input_lengths):
+    """Follow the int8 backpointers (reverse state order) on the host, all items at once per
+    frame; frames after an item's length stay on state 0 (blank)."""
+    batch_size, input_time_size, num_states = backpointers.size()
+    backpointers = backpointers.cpu().numpy()
+    state = final_states.cpu().numpy().astype(np.int64)
+    input_lengths = input_lengths.cpu().numpy()
+    rows = np.arange(batch_size)
+
+    path = np.zeros((batch_size, input_time_size), dtype=np.int64)
     for t in range(input_time_size - 1, 0, -1):
-        target_indices = path[:, t]
-        prev_max_idx = backpointers[bsz_indices, t, target_indices]
-        path[:, t - 1] += target_indices - prev_max_idx
+        live = input_lengths > t
+        path[:, t] = state * live
+        state -= backpointers[rows, t, num_states - 1 - state] * live
+    path[:, 0] = state * (input_lengths > 0)
+    return torch.from_numpy(path)
+
+
+def _torchaudio_items(targets, input_lengths, target_lengths, blank):
+    """Items `torchaudio.functional.forced_align` accepts: a non-empty target without blank
+    that fits in the input (it raises on the others)."""
+    in_target = torch.arange(targets.size(1), device=targets.device)[None, :] < target_lengths[:, None]
+    repeats = ((targets[:, 1:] == targets[:, :-1]) & in_target[:, 1:]).sum(dim=1)
+    return (
+        (target_lengths > 0)
+        & ~((targets == blank) & in_target).any(dim=1)
+        & (input_lengths.to(targets.device) >= target_lengths + repeats)
+    ).cpu()
+
 
-    alignments = _t_a_r_g_e_t_s_.gather(dim=-1, index=(path - padding_num).clamp(min=0))
+def _forced_align_torchaudio(log_probs, targets, input_lengths, target_lengths, blank):
+    batch_size, input_time_size, _ = log_probs.size()
+    alignments = torch.full(
+        (batch_size, input_time_size), blank, device=log_probs.device, dtype=targets.dtype
+    )
+    for b in range(batch_size):
+        input_length, target_length = int(input_lengths[b]), int(target_lengths[b])
+        aligned, _ = _torchaudio_forced_align(
+            log_probs[b : b + 1, :input_length].float(),
+            targets[b : b + 1, :target_length].int(),
+            input_lengths[b : b + 1].int(),
+            target_lengths[b : b + 1].int(),
+            blank=blank,
+        )
+        alignments[b, :input_length] = aligned[0].to(targets.dtype)
     return alignments
@@ -1,5 +1,4 @@
 import os
-import torch
 
 
 def export(
@@ -33,6 +32,7 @@ def _onnx(
     export_dir: str = None,
     **kwargs,
 ):
+    import torch
 
     dummy_input = model.export_dummy_inputs()
 
@@ -71,3 +71,272 @@ def _onnx(
                 weight_type=QuantType.QUInt8,
                 nodes_to_exclude=nodes_to_exclude,
             )
+
+
+# ---------------------------------------------------------------------------
+# ONNX variants for serving: offline-optimized graph, fp16 and calibrated static int8,
+# measured on sample audio and listed in a manifest the serving side picks from.
+
+MANIFEST_NAME = "variants.json"
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+
+def _quant_nodes_to_exclude(model_path):
+    import onnx
+
+    nodes = [n.name for n in onnx.load(model_path).graph.node]
+    return [m for m in nodes if "output" in m or "bias_encoder" in m or "bias_decoder" in m]
+
+
+def optimize_onnx(model_path: str, output_path: str = None, intra_op_num_threads: int = 1):
+    """Serialize the ORT_ENABLE_ALL graph so sessions skip graph optimization at startup.
+
+    The result contains CPU-provider specific fused ops and must be loaded with optimizations
+    disabled or on the CPU provider only.
+    """
+    from onnxruntime import GraphOptimizationLevel, InferenceSession, SessionOptions
+
+    output_path = output_path or model_path.replace(".onnx", "_opt.onnx")
+    sess_opt = SessionOptions()
+    sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_opt.intra_op_num_threads = intra_op_num_threads
+    sess_opt.optimized_model_filepath = output_path
+    InferenceSession(model_path, sess_options=sess_opt, providers=["CPUExecutionProvider"])
+    return output_path
+
+
+def convert_fp16(model_path: str, output_path: str = None):
+    """float16 weights and activations, float32 inputs and outputs (needs onnxconverter-common)."""
+    import onnx
+
+    try:
+        from onnxconverter_common import float16
+    except ImportError as e:
+        raise ImportError("fp16 export needs `pip install onnxconverter-common`") from e
+
+    output_path = output_path or model_path.replace(".onnx", "_fp16.onnx")
+    model = float16.convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+    return output_path
+
+
+def list_audio(path: str):
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    else:
+        import glob
+
+        files = sorted(glob.glob(path))
+    return [f for f in files if f.lower().endswith(AUDIO_EXTENSIONS)]
+
+
+def _make_calibration_reader(model_path, frontend, wavs, language=0, textnorm=15):
+    import numpy as np
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import CalibrationDataReader
+
+    from utils.audio_io import read_audio
+
+    input_names = [
+        v.name for v in InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()
+    ]
+
+    class WavCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.wavs = iter(wavs)
+
+        def get_next(self):
+            wav = next(self.wavs, None)
+            if wav is None:
+                return None
+            waveform = read_audio(wav, fs=int(frontend.opts.frame_opts.samp_freq))
+            feat, feat_len = frontend.lfr_cmvn(frontend.fbank(waveform)[0])
+            inputs = [
+                feat[None].astype(np.float32),
+                np.array([feat_len], dtype=np.int32),
+                np.array([language], dtype=np.int32),
+                np.array([textnorm], dtype=np.int32),
+            ]
+            return dict(zip(input_names, inputs))
+
+    return WavCalibrationReader()
+
+
+def quantize_static_int8(model_dir: str, calib_audio: str, model_name: str = "model.onnx",
+                         output_path: str = None, max_calib_files: int = 200, per_channel: bool = True):
+    """Static (QDQ) int8 of the MatMuls, activation ranges calibrated on sample audio."""
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    from utils.frontend import WavFrontend
+    from utils.infer_utils import read_yaml
+
+    model_path = os.path.join(model_dir, model_name)
+    output_path = output_path or os.path.join(model_dir, "model_static_int8.onnx")
+    config = read_yaml(os.path.join(model_dir, "config.yaml"))
+    config["frontend_conf"]["cmvn_file"] = os.path.join(model_dir, "am.mvn")
+    config["frontend_conf"]["dither"] = 0.0
+    frontend = WavFrontend(**config["frontend_conf"])
+    wavs = list_audio(calib_audio)[:max_calib_files]
+    if not wavs:
+        raise FileNotFoundError(f"no calibration audio found in {calib_audio}")
+
+    model_input = model_path
+    try:
+        # symbolic shape inference lets the quantizer see every tensor it calibrates
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+
+        model_input = output_path.replace(".onnx", "_infer.onnx")
+        quant_pre_process(model_path, model_input, skip_optimization=True)
+    except Exception:
+        model_input = model_path
+    try:
+        quantize_static(
+            model_input,
+            output_path,
+            _make_calibration_reader(model_path, frontend, wavs),
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=["MatMul"],
+            per_channel=per_channel,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=_quant_nodes_to_exclude(model_path),
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    finally:
+        if model_input != model_path and os.path.exists(model_input):
+            os.remove(model_input)
+    return output_path
+
+
+def _plain_text(s):
+    import re
+
+    return re.sub(r"<\|[^|]*\|>", "", s).strip()
+
+
+def _char_error_rate(refs, hyps):
+    from Levenshtein import distance as levenshtein_distance
+
+    errors = sum(levenshtein_distance(r, h) for r, h in zip(refs, hyps))
+    return errors / max(sum(len(r) for r in refs), 1)
+
+
+def measure_variant(model_dir: str, model_file: str, wavs, intra_op_num_threads: int = 4):
+    """Transcripts and real-time factor of one variant over `wavs`, one file per call."""
+    import time
+
+    from utils.audio_io import read_audio
+    from utils.model_bin import SenseVoiceSmallONNX
+    from utils.onnx_backend import SentencePieceIdTokenizer
+    from utils.infer_utils import read_yaml
+
+    config = read_yaml(os.path.join(model_dir, "config.yaml"))
+    tokenizer = SentencePieceIdTokenizer(
+        os.path.join(model_dir, os.path.basename(config["tokenizer_conf"]["bpemodel"]))
+    )
+    asr = SenseVoiceSmallONNX(model_dir, model_file=model_file, intra_op_num_threads=intra_op_num_threads)
+    fs = int(asr.frontend.opts.frame_opts.samp_freq)
+    waveforms = [read_audio(wav, fs=fs) for wav in wavs]
+    duration = sum(len(w) for w in waveforms) / fs
+
+    asr(waveforms[0], language=0, textnorm=14)  # warm up
+    texts = []
+    start = time.perf_counter()
+    for waveform in waveforms:
+        texts.append(_plain_text(asr(waveform, language=0, textnorm=14, tokenizer=tokenizer)[0]))
+    return texts, (time.perf_counter() - start) / duration
+
+
+def build_variants(model_dir: str, eval_audio: str, calib_audio: str = None, fp16: bool = True,
+                   static_int8: bool = True, intra_op_num_threads: int = 4):
+    """Write the optimized / fp16 / static int8 variants next to `model.onnx`, measure every
+    variant present (including an existing `model_quant.onnx`) on `eval_audio` and save the
+    manifest. CER is against `<audio>.txt` references when all of them exist, otherwise
+    against the float32 model's transcripts."""
+    import json
+
+    import onnxruntime
+
+    model_path = os.path.join(model_dir, "model.onnx")
+    files = ["model.onnx"]
+    if os.path.exists(os.path.join(model_dir, "model_quant.onnx")):
+        files.append("model_quant.onnx")
+    if fp16:
+        files.append(os.path.basename(convert_fp16(model_path)))
+    if static_int8:
+        files.append(os.path.basename(quantize_static_int8(model_dir, calib_audio or eval_audio)))
+    for name in list(files):
+        if name.startswith("model_fp16"):
+            # fp16 graphs get their own Cast-heavy fusions, keep them as exported
+            continue
+        files.append(os.path.basename(optimize_onnx(os.path.join(model_dir, name))))
+
+    wavs = list_audio(eval_audio)
+    if not wavs:
+        raise FileNotFoundError(f"no evaluation audio found in {eval_audio}")
+    refs = []
+    for wav in wavs:
+        txt = os.path.splitext(wav)[0] + ".txt"
+        if not os.path.exists(txt):
+            refs = None
+            break
+        with open(txt, "r", encoding="utf-8") as f:
+            refs.append(f.read().strip())
+
+    variants = []
+    baseline = None
+    for name in files:
+        texts, rtf = measure_variant(model_dir, name, wavs, intra_op_num_threads)
+        if baseline is None:
+            baseline = texts
+        variants.append({
+            "file": name,
+            "rtf": round(rtf, 5),
+            "cer": round(_char_error_rate(refs if refs is not None else baseline, texts), 5),
+            "size_mb": round(os.path.getsize(os.path.join(model_dir, name)) / 2**20, 1),
+        })
+        print(f"{name:<32} RTF {rtf:.4f}  CER {variants[-1]['cer']:.4f}  {variants[-1]['size_mb']} MB")
+
+    manifest = {
+        "cer_reference": "text" if refs is not None else "model.onnx",
+        "onnxruntime": onnxruntime.__version__,
+        "intra_op_num_threads": intra_op_num_threads,
+        "num_files": len(wavs),
+        "variants": variants,
+    }
+    with open(os.path.join(model_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def select_variant(model_dir: str, cer_budget: float = 0.01, default: str = "model.onnx"):
+    """Fastest variant of the manifest whose CER exceeds the float32 model's by at most
+    `cer_budget`; `default` when there is no manifest."""
+    import json
+
+    manifest_path = os.path.join(model_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return default
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        variants = json.load(f)["variants"]
+    base_cer = next((v["cer"] for v in variants if v["file"] == "model.onnx"), 0.0)
+    allowed = [
+        v for v in variants
+        if v["cer"] <= base_cer + cer_budget and os.path.exists(os.path.join(model_dir, v["file"]))
+    ]
+    return min(allowed, key=lambda v: v["rtf"])["file"] if allowed else default
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="生成并评测 SenseVoiceSmall 的 ONNX 部署变体")
+    parser.add_argument("-m", "--model-dir", default="./models/iic/SenseVoiceSmall", help="包含 model.onnx 的模型目录")
+    parser.add_argument("-a", "--audio", required=True, help="评测音频目录或通配路径")
+    parser.add_argument("--calib-audio", default=None, help="静态 int8 校准音频，默认与评测音频相同")
+    parser.add_argument("--no-fp16", action="store_true", help="不生成 fp16 模型")
+    parser.add_argument("--no-static-int8", action="store_true", help="不生成静态 int8 模型")
+    parser.add_argument("--threads", type=int, default=4, help="ONNX Runtime 线程数")
+    args = parser.parse_args()
+    build_variants(args.model_dir, args.audio, args.calib_audio, fp16=not args.no_fp16,
+                   static_int8=not args.no_static_int8, intra_op_num_threads=args.threads)
@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from utils.infer_utils import get_logger
+
+logging = get_logger()
+
+
+class FeatureCache:
+    """
+    Post-CMVN features on disk as float16 .npy files, memory-mapped when read back.
+
+    An entry is keyed by the sha256 of the input (the file bytes for a path, the samples for
+    an array) together with the frontend configuration, so decoding the same audio again with
+    another language or text normalization skips loading, resampling and fbank/LFR/CMVN.
+    The directory is bounded by `max_bytes`; the least recently used entries are removed first.
+    `put` may be called from several request threads; the size accounting is locked.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 4 << 30):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.total_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.npy"))
+
+    def key(self, data, config: dict) -> Optional[str]:
+        """Cache key of an input path / array under a frontend config, None if not cacheable."""
+        sha = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode())
+        if isinstance(data, (str, Path)):
+            if not os.path.isfile(data):
+                return None
+            sha.update(b"file")
+            with open(data, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+        else:
+            if hasattr(data, "detach"):
+                data = data.detach().cpu().numpy()
+            data = np.ascontiguousarray(data)
+            sha.update(f"pcm:{data.dtype.str}:{data.shape}".encode())
+            sha.update(memoryview(data).cast("B"))
+        return sha.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.npy"
+
+    def get(self, key: Optional[str]) -> Optional[np.ndarray]:
+        """The cached (frames, dim) float16 features as a read-only memmap, or None."""
+        if key is None:
+            return None
+        path = self.path(key)
+        try:
+            feats = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return feats
+
+    def put(self, key: Optional[str], feats: np.ndarray) -> np.ndarray:
+        """Store features as float16 and return the float16 array, which holds the values `get`
+        will return, so a decode gives the same result whether or not the cache was warm."""
+        feats = np.asarray(feats, dtype=np.float16)
+        if key is None:
+            return feats
+        path = self.path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # per process and thread, two threads may store the same key at once
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, feats)
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except OSError as e:
+            logging.warning(f"feature cache write failed: {e}")
+            return feats
+        with self._lock:
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return feats
+
+    def evict(self):
+        """Remove least recently used entries until the cache is below 90% of `max_bytes`."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for p in self.cache_dir.glob("*/*.npy"):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                p.unlink()
+                self.total_bytes -= size
+            except FileNotFoundError:
+                pass
@@ -2,6 +2,9 @@
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
 import copy
+import hashlib
+import os
+import threading
 
 import numpy as np
 import kaldi_native_fbank as knf
@@ -10,6 +13,152 @@ root_dir = Path(__file__).resolve().parent
 
 logger_initialized = {}
 
+# frames per block of the numpy fbank, bounds its temporary buffers on long inputs
+FBANK_BLOCK_FRAMES = 1024
+# LFR frames stacked and normalized per block in lfr_cmvn, small enough to stay in cache
+LFR_BLOCK_FRAMES = 512
+
+
+_cmvn_registry = {}
+_cmvn_lock = threading.Lock()
+
+
+def parse_cmvn(cmvn_file: Union[str, Path]) -> np.ndarray:
+    """(2, dim) float32 shift and scale rows of a Kaldi nnet-style text am.mvn."""
+    with open(cmvn_file, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    means_list = []
+    vars_list = []
+    for i in range(len(lines)):
+        line_item = lines[i].split()
+        if not line_item:
+            continue
+        if line_item[0] == "<AddShift>":
+            line_item = lines[i + 1].split()
+            if line_item[0] == "<LearnRateCoef>":
+                add_shift_line = line_item[3 : (len(line_item) - 1)]
+                means_list = list(add_shift_line)
+                continue
+        elif line_item[0] == "<Rescale>":
+            line_item = lines[i + 1].split()
+            if line_item[0] == "<LearnRateCoef>":
+                rescale_line = line_item[3 : (len(line_item) - 1)]
+                vars_list = list(rescale_line)
+                continue
+
+    means = np.array(means_list).astype(np.float32)
+    vars = np.array(vars_list).astype(np.float32)
+    cmvn = np.array([means, vars])
+    return cmvn
+
+
+def load_cmvn_stats(cmvn_file: Union[str, Path]) -> np.ndarray:
+    """
+    CMVN stats of `cmvn_file`, parsed once per process and shared read-only by all frontends.
+
+    The parsed array is also saved next to the text file as `<name>.<sha256 prefix>.npy`, so
+    later processes load it instead of parsing; a sidecar with another hash is stale and
+    removed. Unwritable model directories just skip the sidecar.
+    """
+    path = os.path.realpath(cmvn_file)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _cmvn_lock:
+        cmvn = _cmvn_registry.get(key)
+        if cmvn is not None:
+            return cmvn
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        sidecar = Path(f"{path}.{digest}.npy")
+        cmvn = None
+        if sidecar.exists():
+            try:
+                cmvn = np.load(sidecar)
+            except (OSError, ValueError):
+                cmvn = None
+        if cmvn is None:
+            cmvn = parse_cmvn(path)
+            try:
+                for stale in sidecar.parent.glob(f"{Path(path).name}.*.npy"):
+                    stale.unlink()
+                tmp = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    np.save(f, cmvn)
+                os.replace(tmp, sidecar)
+            except OSError:
+                pass
+
+        cmvn = np.ascontiguousarray(cmvn, dtype=np.float32)
+        cmvn.flags.writeable = False
+        _cmvn_registry.update({k: v for k, v in _cmvn_registry.items() if k[0] != path})
+        _cmvn_registry[key] = cmvn
+        return cmvn
+
+
+def kaldi_window(window_type: str, frame_length: int) -> np.ndarray:
+    """Analysis window as computed by kaldi's FeatureWindowFunction."""
+    a = 2 * np.pi / (frame_length - 1)
+    i = np.arange(frame_length, dtype=np.float64)
+    if window_type == "hanning":
+        window = 0.5 - 0.5 * np.cos(a * i)
+    elif window_type == "hamming":
+        window = 0.54 - 0.46 * np.cos(a * i)
+    elif window_type == "povey":
+        window = np.power(0.5 - 0.5 * np.cos(a * i), 0.85)
+    elif window_type == "rectangular":
+        window = np.ones(frame_length)
+    elif window_type == "blackman":
+        window = 0.42 - 0.5 * np.cos(a * i) + 0.08 * np.cos(2 * a * i)
+    else:
+        raise ValueError(f"unsupported window type {window_type}")
+    return window.astype(np.float32)
+
+
+def kaldi_mel_banks(
+    num_bins: int, samp_freq: float, padded_length: int, low_freq: float = 20.0, high_freq: float = 0.0
+) -> np.ndarray:
+    """(padded_length // 2 + 1, num_bins) triangular mel weights of kaldi's MelBanks, the
+    Nyquist bin included with zero weight so it applies to a full rfft power spectrum."""
+    nyquist = 0.5 * samp_freq
+    if high_freq <= 0.0:
+        high_freq += nyquist
+
+    def mel_scale(freq):
+        return 1127.0 * np.log(1.0 + np.asarray(freq, dtype=np.float64) / 700.0)
+
+    mel_low, mel_high = mel_scale(low_freq), mel_scale(high_freq)
+    delta = (mel_high - mel_low) / (num_bins + 1)
+    left = (mel_low + np.arange(num_bins) * delta)[:, None]
+    center, right = left + delta, left + 2 * delta
+    mel = mel_scale(np.arange(padded_length // 2) * samp_freq / padded_length)[None, :]
+    weights = np.where(mel <= center, (mel - left) / (center - left), (right - mel) / (right - center))
+    weights = np.where((mel > left) & (mel < right), weights, 0.0)
+
+    banks = np.zeros((padded_length // 2 + 1, num_bins), dtype=np.float32)
+    banks[: padded_length // 2] = weights.T
+    return banks
+
+
+def lfr_indices(num_frames: int, num_lfr: int, lfr_m: int, lfr_n: int, left_padding: int = 0) -> np.ndarray:
+    """(num_lfr, lfr_m) input rows stacked into each LFR frame; rows before the start and past
+    the end repeat the first and the last frame, which is how the LFR frames are padded."""
+    rows = np.arange(num_lfr)[:, None] * lfr_n + np.arange(lfr_m)[None, :] - left_padding
+    return np.clip(rows, 0, max(num_frames - 1, 0))
+
+
+def stack_lfr(inputs: np.ndarray, rows: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Gather `rows` of `inputs` into a (num_lfr, lfr_m * dim) float32 matrix, in `out` if given."""
+    num_lfr, lfr_m = rows.shape
+    dim = inputs.shape[1]
+    if out is None:
+        out = np.empty((num_lfr, lfr_m * dim), dtype=np.float32)
+    out = out[:num_lfr]
+    if num_lfr:
+        np.take(inputs.astype(np.float32, copy=False), rows, axis=0, out=out.reshape(num_lfr, lfr_m, dim))
+    return out
+
 
 class WavFrontend:
     """Conventional frontend structure for ASR."""
@@ -25,8 +174,12 @@ class WavFrontend:
         lfr_m: int = 1,
         lfr_n: int = 1,
         dither: float = 1.0,
+        fbank_impl: str = "numpy",
         **kwargs,
     ) -> None:
+        """fbank_impl: "numpy" computes kaldi fbank vectorized over blocks of frames, "knf"
+        runs kaldi-native-fbank. knf works in float32 while the numpy FFT and power spectrum run
+        in float64, so their log-mel features differ by up to about 1e-3."""
 
         opts = knf.FbankOptions()
         opts.frame_opts.samp_freq = fs
@@ -40,6 +193,18 @@ class WavFrontend:
         opts.mel_opts.debug_mel = False
         self.opts = opts
 
+        self.frame_sample_length = int(frame_length * fs / 1000)
+        self.frame_shift_sample_length = int(frame_shift * fs / 1000)
+        self.fbank_impl = fbank_impl
+        if fbank_impl == "numpy":
+            self.padded_length = 1 << (self.frame_sample_length - 1).bit_length()
+            self.window = kaldi_window(window, self.frame_sample_length)
+            self.mel_banks = kaldi_mel_banks(
+                n_mels, fs, self.padded_length, opts.mel_opts.low_freq, opts.mel_opts.high_freq
+            )
+        elif fbank_impl != "knf":
+            raise ValueError(f"fbank_impl must be 'numpy' or 'knf', got {fbank_impl}")
+
         self.lfr_m = lfr_m
         self.lfr_n = lfr_n
         self.cmvn_file = cmvn_file
@@ -50,156 +215,206 @@ class WavFrontend:
         self.fbank_beg_idx = 0
         self.reset_status()
 
-    def fbank(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        waveform = waveform * (1 << 15)
-        self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
-        frames = self.fbank_fn.num_frames_ready
-        mat = np.empty([frames, self.opts.mel_opts.num_bins])
-        for i in range(frames):
-            mat[i, :] = self.fbank_fn.get_frame(i)
-        feat = mat.astype(np.float32)
-        feat_len = np.array(mat.shape[0]).astype(np.int32)
+    def num_frames(self, num_samples: int) -> int:
+        if num_samples < self.frame_sample_length:
+            return 0
+        return 1 + (num_samples - self.frame_sample_length) // self.frame_shift_sample_length
+
+    def fbank(self, waveform: np.ndarray, out: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Log-mel fbank of a waveform in [-1, 1]; `out` is an optional float32 buffer with at
+        least `num_frames(len(waveform))` rows that the features are written into."""
+        frames = self.num_frames(len(waveform))
+        if out is None:
+            out = np.empty((frames, self.opts.mel_opts.num_bins), dtype=np.float32)
+        feat = out[:frames]
+        if self.fbank_impl == "numpy":
+            self._fbank_numpy(waveform, feat)
+        else:
+            # a local OnlineFbank keeps fbank safe to call from several threads
+            fbank_fn = knf.OnlineFbank(self.opts)
+            fbank_fn.accept_waveform(
+                self.opts.frame_opts.samp_freq, np.multiply(waveform, 1 << 15, dtype=np.float32)
+            )
+            self._pull_frames(fbank_fn, 0, feat)
+        feat_len = np.array(frames).astype(np.int32)
         return feat, feat_len
 
+    def _fbank_numpy(self, waveform: np.ndarray, out: np.ndarray):
+        frame_opts = self.opts.frame_opts
+        if len(out) == 0:
+            return
+        frames = np.lib.stride_tricks.sliding_window_view(waveform, self.frame_sample_length)[
+            :: self.frame_shift_sample_length
+        ]
+        eps = np.finfo(np.float32).eps
+        preemph = frame_opts.preemph_coeff
+        for beg in range(0, len(out), FBANK_BLOCK_FRAMES):
+            block = out[beg : beg + FBANK_BLOCK_FRAMES]
+            frame = frames[beg : beg + len(block)].astype(np.float32)
+            frame *= 1 << 15
+            if frame_opts.dither != 0.0:
+                frame += frame_opts.dither * np.random.standard_normal(frame.shape).astype(np.float32)
+            if frame_opts.remove_dc_offset:
+                frame -= frame.mean(axis=1, keepdims=True)
+            if preemph != 0.0:
+                frame[:, 1:] -= preemph * frame[:, :-1]
+                frame[:, 0] *= 1.0 - preemph
+            frame *= self.window
+            # float64 regardless of numpy's float32 FFT support, small bins lose nothing
+            spectrum = np.fft.rfft(frame.astype(np.float64), n=self.padded_length)
+            power = np.square(spectrum.real)
+            power += np.square(spectrum.imag)
+            np.matmul(power.astype(np.float32), self.mel_banks, out=block)
+            np.maximum(block, eps, out=block)
+            np.log(block, out=block)
+
+    @staticmethod
+    def _pull_frames(fbank_fn, beg: int, out: np.ndarray):
+        """Copy ready knf frames `beg, beg + 1, ...` into the rows of `out`; knf only hands out
+        single frames."""
+        for i in range(len(out)):
+            out[i] = fbank_fn.get_frame(beg + i)
+
     def fbank_online(self, waveform: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        waveform = waveform * (1 << 15)
         # self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
+        self.fbank_fn.accept_waveform(
+            self.opts.frame_opts.samp_freq, np.multiply(waveform, 1 << 15, dtype=np.float32)
+        )
         frames = self.fbank_fn.num_frames_ready
-        mat = np.empty([frames, self.opts.mel_opts.num_bins])
-        for i in range(self.fbank_beg_idx, frames):
-            mat[i, :] = self.fbank_fn.get_frame(i)
+        feat = np.empty([frames, self.opts.mel_opts.num_bins], dtype=np.float32)
+        self._pull_frames(self.fbank_fn, self.fbank_beg_idx, feat[self.fbank_beg_idx :])
         # self.fbank_beg_idx += (frames-self.fbank_beg_idx)
-        feat = mat.astype(np.float32)
-        feat_len = np.array(mat.shape[0]).astype(np.int32)
+        feat_len = np.array(feat.shape[0]).astype(np.int32)
         return feat, feat_len
 
     def reset_status(self):
         self.fbank_fn = knf.OnlineFbank(self.opts)
         self.fbank_beg_idx = 0
 
-    def lfr_cmvn(self, feat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    def lfr_cmvn(self, feat: np.ndarray, out: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """LFR then CMVN, both applied block by block in one float32 buffer (`out` if given)."""
         if self.lfr_m != 1 or self.lfr_n != 1:
-            feat = self.apply_lfr(feat, self.lfr_m, self.lfr_n)
-
-        if self.cmvn_file:
-            feat = self.apply_cmvn(feat)
+            rows = self.lfr_rows(feat.shape[0], self.lfr_m, self.lfr_n)
+            if out is None:
+                out = np.empty((len(rows), self.lfr_m * feat.shape[1]), dtype=np.float32)
+            for beg in range(0, len(rows), LFR_BLOCK_FRAMES):
+                block = stack_lfr(feat, rows[beg : beg + LFR_BLOCK_FRAMES], out[beg : beg + LFR_BLOCK_FRAMES])
+                if self.cmvn_file:
+                    self.apply_cmvn(block, inplace=True)
+            feat = out[: len(rows)]
+        elif self.cmvn_file:
+            feat = self.apply_cmvn(feat, out=out)
+        elif out is not None:
+            out[: len(feat)] = feat
+            feat = out[: len(feat)]
 
         feat_len = np.array(feat.shape[0]).astype(np.int32)
         return feat, feat_len
 
+    def feat_dim(self) -> int:
+        return self.opts.mel_opts.num_bins * self.lfr_m
+
+    def num_lfr_frames(self, num_samples: int) -> int:
+        """Number of feature frames `lfr_cmvn(fbank(waveform))` gives for `num_samples` samples."""
+        return -(-self.num_frames(num_samples) // self.lfr_n)
+
+    def extract_batch(
+        self, waveform_list: List[np.ndarray], out: np.ndarray = None, executor=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        fbank + LFR + CMVN of several waveforms, written straight into one zero padded
+        (batch, frames, feat_dim) float32 array: `out` if given (at least as many frames as the
+        longest item), else one just long enough. With a concurrent.futures `executor` the
+        items are processed concurrently; numpy's FFT and matmul run without the GIL.
+        """
+        feats_len = np.array([self.num_lfr_frames(len(w)) for w in waveform_list], dtype=np.int32)
+        if out is None:
+            out = np.empty((len(waveform_list), feats_len.max(initial=0), self.feat_dim()), dtype=np.float32)
+
+        def extract(i):
+            speech, _ = self.fbank(waveform_list[i])
+            self.lfr_cmvn(speech, out=out[i])
+            out[i, feats_len[i] :] = 0
+
+        if executor is not None and len(waveform_list) > 1:
+            list(executor.map(extract, range(len(waveform_list))))
+        else:
+            for i in range(len(waveform_list)):
+                extract(i)
+        return out, feats_len
+
     @staticmethod
-    def apply_lfr(inputs: np.ndarray, lfr_m: int, lfr_n: int) -> np.ndarray:
-        LFR_inputs = []
-
-        T = inputs.shape[0]
-        T_lfr = int(np.ceil(T / lfr_n))
-        left_padding = np.tile(inputs[0], ((lfr_m - 1) // 2, 1))
-        inputs = np.vstack((left_padding, inputs))
-        T = T + (lfr_m - 1) // 2
-        for i in range(T_lfr):
-            if lfr_m <= T - i * lfr_n:
-                LFR_inputs.append((inputs[i * lfr_n : i * lfr_n + lfr_m]).reshape(1, -1))
-            else:
-                # process last LFR frame
-                num_padding = lfr_m - (T - i * lfr_n)
-                frame = inputs[i * lfr_n :].reshape(-1)
-                for _ in range(num_padding):
-                    frame = np.hstack((frame, inputs[-1]))
+    def lfr_rows(num_frames: int, lfr_m: int, lfr_n: int) -> np.ndarray:
+        return lfr_indices(num_frames, -(-num_frames // lfr_n), lfr_m, lfr_n, left_padding=(lfr_m - 1) // 2)
 
-                LFR_inputs.append(frame)
-        LFR_outputs = np.vstack(LFR_inputs).astype(np.float32)
-        return LFR_outputs
+    @staticmethod
+    def apply_lfr(inputs: np.ndarray, lfr_m: int, lfr_n: int, out: np.ndarray = None) -> np.ndarray:
+        """Stack lfr_m frames every lfr_n frames, the first frame repeated (lfr_m - 1) // 2 times
+        in front and the last one behind; `out` is an optional float32 output buffer."""
+        return stack_lfr(inputs, WavFrontend.lfr_rows(inputs.shape[0], lfr_m, lfr_n), out)
 
-    def apply_cmvn(self, inputs: np.ndarray) -> np.ndarray:
+    def apply_cmvn(self, inputs: np.ndarray, inplace: bool = False, out: np.ndarray = None) -> np.ndarray:
         """
-        Apply CMVN with mvn data
+        Apply CMVN with mvn data, broadcasting the float32 stats over the frames. The result is
+        float32, written over `inputs` when `inplace` and it is float32 already, else to `out`.
         """
-        frame, dim = inputs.shape
-        means = np.tile(self.cmvn[0:1, :dim], (frame, 1))
-        vars = np.tile(self.cmvn[1:2, :dim], (frame, 1))
-        inputs = (inputs + means) * vars
-        return inputs
+        dim = inputs.shape[-1]
+        if inplace and inputs.dtype == np.float32:
+            out = inputs
+        elif out is None:
+            out = np.empty(inputs.shape, dtype=np.float32)
+        else:
+            out = out[: inputs.shape[0]]
+        np.add(inputs, self.cmvn[0, :dim], out=out)
+        out *= self.cmvn[1, :dim]
+        return out
 
     def load_cmvn(
         self,
     ) -> np.ndarray:
-        with open(self.cmvn_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        means_list = []
-        vars_list = []
-        for i in range(len(lines)):
-            line_item = lines[i].split()
-            if line_item[0] == "<AddShift>":
-                line_item = lines[i + 1].split()
-                if line_item[0] == "<LearnRateCoef>":
-                    add_shift_line = line_item[3 : (len(line_item) - 1)]
-                    means_list = list(add_shift_line)
-                    continue
-            elif line_item[0] == "<Rescale>":
-                line_item = lines[i + 1].split()
-                if line_item[0] == "<LearnRateCoef>":
-                    rescale_line = line_item[3 : (len(line_item) - 1)]
-                    vars_list = list(rescale_line)
-                    continue
-
-        means = np.array(means_list).astype(np.float64)
-        vars = np.array(vars_list).astype(np.float64)
-        cmvn = np.array([means, vars])
-        return cmvn
+        return load_cmvn_stats(self.cmvn_file)
 
 
 class WavFrontendOnline(WavFrontend):
+    """
+    Streaming frontend, one stream (batch size 1) at a time.
+
+    New fbank frames are written into a reusable buffer right after the LFR splice frames of
+    the previous chunk, and the waveform is kept in a compacting float32 buffer, so the work per
+    chunk only depends on the chunk. With the numpy fbank the new frames are computed in one
+    block from that waveform; with knf the kaldi fbank state lives across chunks and the frames
+    are pulled from it. Features
+    returned by `extract_fbank` belong to the caller; `get_waveforms` and `get_fbank` are views
+    that stay valid until the next chunk.
+    """
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # self.fbank_fn = knf.OnlineFbank(self.opts)
-        # add variables
-        self.frame_sample_length = int(
-            self.opts.frame_opts.frame_length_ms * self.opts.frame_opts.samp_freq / 1000
-        )
-        self.frame_shift_sample_length = int(
-            self.opts.frame_opts.frame_shift_ms * self.opts.frame_opts.samp_freq / 1000
-        )
-        self.waveform = None
-        self.reserve_waveforms = None
-        self.input_cache = None
-        self.lfr_splice_cache = []
+        self.waveforms = None
+        self.fbanks = None
+        self.fbanks_lens = None
+        self._samples = np.empty(int(self.opts.frame_opts.samp_freq) * 2, dtype=np.float32)
+        self._scaled = np.empty(int(self.opts.frame_opts.samp_freq) // 2, dtype=np.float32)
+        self._feat_buf = np.empty((256, self.opts.mel_opts.num_bins), dtype=np.float32)
+        self.cache_reset()
 
     @staticmethod
     # inputs has catted the cache
     def apply_lfr(
-        inputs: np.ndarray, lfr_m: int, lfr_n: int, is_final: bool = False
+        inputs: np.ndarray, lfr_m: int, lfr_n: int, is_final: bool = False, out: np.ndarray = None
     ) -> Tuple[np.ndarray, np.ndarray, int]:
         """
         Apply lfr with data
         """
-
-        LFR_inputs = []
         T = inputs.shape[0]  # include the right context
-        T_lfr = int(
-            np.ceil((T - (lfr_m - 1) // 2) / lfr_n)
-        )  # minus the right context: (lfr_m - 1) // 2
-        splice_idx = T_lfr
-        for i in range(T_lfr):
-            if lfr_m <= T - i * lfr_n:
-                LFR_inputs.append((inputs[i * lfr_n : i * lfr_n + lfr_m]).reshape(1, -1))
-            else:  # process last LFR frame
-                if is_final:
-                    num_padding = lfr_m - (T - i * lfr_n)
-                    frame = (inputs[i * lfr_n :]).reshape(-1)
-                    for _ in range(num_padding):
-                        frame = np.hstack((frame, inputs[-1]))
-                    LFR_inputs.append(frame)
-                else:
-                    # update splice_idx and break the circle
-                    splice_idx = i
-                    break
-        splice_idx = min(T - 1, splice_idx * lfr_n)
+        T_lfr = -(-(T - (lfr_m - 1) // 2) // lfr_n)  # minus the right context: (lfr_m - 1) // 2
+        # frames with all lfr_m inputs present; the rest wait for more input unless is_final
+        num_full = min(T_lfr, (T - lfr_m) // lfr_n + 1) if T >= lfr_m else 0
+        num_lfr = T_lfr if is_final else num_full
+        splice_idx = min(T - 1, (T_lfr if num_lfr == T_lfr else num_full) * lfr_n)
         lfr_splice_cache = inputs[splice_idx:, :]
-        LFR_outputs = np.vstack(LFR_inputs)
-        return LFR_outputs.astype(np.float32), lfr_splice_cache, splice_idx
+        LFR_outputs = stack_lfr(inputs, lfr_indices(T, num_lfr, lfr_m, lfr_n), out)
+        return LFR_outputs, lfr_splice_cache, splice_idx
 
     @staticmethod
     def compute_frame_num(
@@ -208,55 +423,80 @@ class WavFrontendOnline(WavFrontend):
         frame_num = int((sample_length - frame_sample_length) / frame_shift_sample_length + 1)
         return frame_num if frame_num >= 1 and sample_length >= frame_sample_length else 0
 
+    def _append_samples(self, samples: np.ndarray):
+        """Keep `samples` for `get_waveforms`, dropping what no later waveform can include."""
+        keep_from = self._frames_done * self.frame_shift_sample_length
+        if self._reserve_start is not None:
+            keep_from = self._reserve_start
+        used = self._sample_end - self._sample_offset
+        if used + len(samples) > len(self._samples):
+            drop = keep_from - self._sample_offset
+            if used - drop + len(samples) > len(self._samples):
+                grown = np.empty(max(2 * len(self._samples), used - drop + len(samples)), dtype=np.float32)
+                grown[: used - drop] = self._samples[drop:used]
+                self._samples = grown
+            else:
+                self._samples[: used - drop] = self._samples[drop:used]
+            self._sample_offset = keep_from
+            used -= drop
+        self._samples[used : used + len(samples)] = samples
+        self._sample_end += len(samples)
+
+    def _stream(self, beg: int, end: int) -> np.ndarray:
+        """(1, end - beg) view of the kept waveform between stream sample indices."""
+        return self._samples[None, beg - self._sample_offset : end - self._sample_offset]
+
     def fbank(
         self, input: np.ndarray, input_lengths: np.ndarray
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        self.fbank_fn = knf.OnlineFbank(self.opts)
-        batch_size = input.shape[0]
-        if self.input_cache is None:
-            self.input_cache = np.empty((batch_size, 0), dtype=np.float32)
-        input = np.concatenate((self.input_cache, input), axis=1)
-        frame_num = self.compute_frame_num(
-            input.shape[-1], self.frame_sample_length, self.frame_shift_sample_length
-        )
-        # update self.in_cache
-        self.input_cache = input[
-            :, -(input.shape[-1] - frame_num * self.frame_shift_sample_length) :
-        ]
+        """Feed a (1, samples) chunk to the fbank state; returns the waveform covering the new
+        frames, the new frames (1, frames, n_mels) and their number, or empty arrays."""
+        chunk = input[0]
+        self._append_samples(chunk)
+        if self.fbank_impl == "numpy":
+            frame_num = self.num_frames(self._sample_end) - self._frames_done
+        else:
+            if len(chunk) > len(self._scaled):
+                self._scaled = np.empty(max(2 * len(self._scaled), len(chunk)), dtype=np.float32)
+            scaled = self._scaled[: len(chunk)]
+            np.multiply(chunk, 1 << 15, out=scaled)
+            self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, scaled)
+            frame_num = self.fbank_fn.num_frames_ready - self._frames_done
+
         waveforms = np.empty(0, dtype=np.float32)
         feats_pad = np.empty(0, dtype=np.float32)
         feats_lens = np.empty(0, dtype=np.int32)
         if frame_num:
-            waveforms = []
-            feats = []
-            feats_lens = []
-            for i in range(batch_size):
-                waveform = input[i]
-                waveforms.append(
-                    waveform[
-                        : (
-                            (frame_num - 1) * self.frame_shift_sample_length
-                            + self.frame_sample_length
-                        )
-                    ]
-                )
-                waveform = waveform * (1 << 15)
-
-                self.fbank_fn.accept_waveform(self.opts.frame_opts.samp_freq, waveform.tolist())
-                frames = self.fbank_fn.num_frames_ready
-                mat = np.empty([frames, self.opts.mel_opts.num_bins])
-                for i in range(frames):
-                    mat[i, :] = self.fbank_fn.get_frame(i)
-                feat = mat.astype(np.float32)
-                feat_len = np.array(mat.shape[0]).astype(np.int32)
-                feats.append(feat)
-                feats_lens.append(feat_len)
-
-            waveforms = np.stack(waveforms)
-            feats_lens = np.array(feats_lens)
-            feats_pad = np.array(feats)
+            first = self._frames_done
+            waveforms = self._stream(
+                first * self.frame_shift_sample_length,
+                (first + frame_num - 1) * self.frame_shift_sample_length + self.frame_sample_length,
+            )
+            # move the splice frames to the front, then the new frames go after them; the
+            # first frames leave (lfr_m - 1) // 2 rows for the left padding of extract_fbank
+            splice_len = self._feat_len - self._feat_beg
+            self._feat_buf[:splice_len] = self._feat_buf[self._feat_beg : self._feat_len]
+            self._feat_beg, self._feat_len = 0, splice_len
+            if not self._splice_ready:
+                self._feat_len += (self.lfr_m - 1) // 2
+            if self._feat_len + frame_num > len(self._feat_buf):
+                grown = np.empty((max(2 * len(self._feat_buf), self._feat_len + frame_num), self._feat_buf.shape[1]),
+                                 dtype=np.float32)
+                grown[: self._feat_len] = self._feat_buf[: self._feat_len]
+                self._feat_buf = grown
+            feats = self._feat_buf[self._feat_len : self._feat_len + frame_num]
+            if self.fbank_impl == "numpy":
+                self._fbank_numpy(waveforms[0], feats)
+            else:
+                self._pull_frames(self.fbank_fn, first, feats)
+                if hasattr(self.fbank_fn, "pop"):
+                    self.fbank_fn.pop(frame_num)
+            self._feat_len += frame_num
+            self._frames_done += frame_num
+            feats_pad = feats[None]
+            feats_lens = np.array([frame_num], dtype=np.int32)
         self.fbanks = feats_pad
-        self.fbanks_lens = copy.deepcopy(feats_lens)
+        self.fbanks_lens = feats_lens
         return waveforms, feats_pad, feats_lens
 
     def get_fbank(self) -> Tuple[np.ndarray, np.ndarray]:
@@ -265,28 +505,20 @@ class WavFrontendOnline(WavFrontend):
     def lfr_cmvn(
         self, input: np.ndarray, input_lengths: np.ndarray, is_final: bool = False
     ) -> Tuple[np.ndarray, np.ndarray, List[int]]:
-        batch_size = input.shape[0]
-        feats = []
-        feats_lens = []
-        lfr_splice_frame_idxs = []
-        for i in range(batch_size):
-            mat = input[i, : input_lengths[i], :]
-            lfr_splice_frame_idx = -1
-            if self.lfr_m != 1 or self.lfr_n != 1:
-                # update self.lfr_splice_cache in self.apply_lfr
-                mat, self.lfr_splice_cache[i], lfr_splice_frame_idx = self.apply_lfr(
-                    mat, self.lfr_m, self.lfr_n, is_final
-                )
+        """LFR + CMVN of the splice and new frames in the feature buffer (`input` is a view of
+        them); the frames the next chunk still needs stay in the buffer as the splice."""
+        mat = input[0, : input_lengths[0], :]
+        lfr_splice_frame_idx = -1
+        if self.lfr_m != 1 or self.lfr_n != 1:
+            mat, _, lfr_splice_frame_idx = self.apply_lfr(mat, self.lfr_m, self.lfr_n, is_final)
+            self._feat_beg += lfr_splice_frame_idx
             if self.cmvn_file is not None:
-                mat = self.apply_cmvn(mat)
-            feat_length = mat.shape[0]
-            feats.append(mat)
-            feats_lens.append(feat_length)
-            lfr_splice_frame_idxs.append(lfr_splice_frame_idx)
-
-        feats_lens = np.array(feats_lens)
-        feats_pad = np.array(feats)
-        return feats_pad, feats_lens, lfr_splice_frame_idxs
+                # the LFR output is a fresh buffer, normalize it in place
+                mat = self.apply_cmvn(mat, inplace=True)
+        else:
+            self._feat_beg = self._feat_len
+            mat = self.apply_cmvn(mat) if self.cmvn_file is not None else mat.copy()
+        return mat[None], np.array([mat.shape[0]]), [lfr_splice_frame_idx]
 
     def extract_fbank(
         self, input: np.ndarray, input_lengths: np.ndarray, is_final: bool = False
@@ -295,64 +527,45 @@ class WavFrontendOnline(WavFrontend):
         assert (
             batch_size == 1
         ), "we support to extract feature online only when the batch size is equal to 1 now"
+        shift = self.frame_shift_sample_length
         waveforms, feats, feats_lengths = self.fbank(input, input_lengths)  # input shape: B T D
         if feats.shape[0]:
-            self.waveforms = (
-                waveforms
-                if self.reserve_waveforms is None
-                else np.concatenate((self.reserve_waveforms, waveforms), axis=1)
-            )
-            if not self.lfr_splice_cache:
-                for i in range(batch_size):
-                    self.lfr_splice_cache.append(
-                        np.expand_dims(feats[i][0, :], axis=0).repeat((self.lfr_m - 1) // 2, axis=0)
-                    )
-
-            if feats_lengths[0] + self.lfr_splice_cache[0].shape[0] >= self.lfr_m:
-                lfr_splice_cache_np = np.stack(self.lfr_splice_cache)  # B T D
-                feats = np.concatenate((lfr_splice_cache_np, feats), axis=1)
-                feats_lengths += lfr_splice_cache_np[0].shape[0]
-                frame_from_waveforms = int(
-                    (self.waveforms.shape[1] - self.frame_sample_length)
-                    / self.frame_shift_sample_length
-                    + 1
-                )
-                minus_frame = (self.lfr_m - 1) // 2 if self.reserve_waveforms is None else 0
+            # the waveform since the oldest frame still in the LFR splice, up to the last frame
+            waveform_beg = self._reserve_start
+            if waveform_beg is None:
+                waveform_beg = (self._frames_done - feats_lengths[0]) * shift
+            self.waveforms = self._stream(waveform_beg, (self._frames_done - 1) * shift + self.frame_sample_length)
+            if not self._splice_ready:
+                pad = (self.lfr_m - 1) // 2
+                self._feat_buf[self._feat_beg : self._feat_beg + pad] = feats[0, 0]
+                self._splice_ready = True
+
+            splice_len = self._feat_len - self._feat_beg - feats_lengths[0]
+            if feats_lengths[0] + splice_len >= self.lfr_m:
+                feats = self._feat_buf[None, self._feat_beg : self._feat_len]
+                feats_lengths += splice_len
+                minus_frame = (self.lfr_m - 1) // 2 if self._reserve_start is None else 0
                 feats, feats_lengths, lfr_splice_frame_idxs = self.lfr_cmvn(
                     feats, feats_lengths, is_final
                 )
                 if self.lfr_m == 1:
-                    self.reserve_waveforms = None
+                    self._reserve_start = None
                 else:
                     reserve_frame_idx = lfr_splice_frame_idxs[0] - minus_frame
-                    # print('reserve_frame_idx:  ' + str(reserve_frame_idx))
-                    # print('frame_frame:  ' + str(frame_from_waveforms))
-                    self.reserve_waveforms = self.waveforms[
-                        :,
-                        reserve_frame_idx
-                        * self.frame_shift_sample_length : frame_from_waveforms
-                        * self.frame_shift_sample_length,
-                    ]
-                    sample_length = (
-                        frame_from_waveforms - 1
-                    ) * self.frame_shift_sample_length + self.frame_sample_length
-                    self.waveforms = self.waveforms[:, :sample_length]
+                    # an empty reserve when the index is past the waveform, as slicing gave
+                    self._reserve_start = min(waveform_beg + reserve_frame_idx * shift, self._frames_done * shift)
             else:
-                # update self.reserve_waveforms and self.lfr_splice_cache
-                self.reserve_waveforms = self.waveforms[
-                    :, : -(self.frame_sample_length - self.frame_shift_sample_length)
-                ]
-                for i in range(batch_size):
-                    self.lfr_splice_cache[i] = np.concatenate(
-                        (self.lfr_splice_cache[i], feats[i]), axis=0
-                    )
+                # keep the whole waveform; the new frames already follow the splice frames
+                self._reserve_start = waveform_beg
                 return np.empty(0, dtype=np.float32), feats_lengths
         else:
             if is_final:
                 self.waveforms = (
-                    waveforms if self.reserve_waveforms is None else self.reserve_waveforms
+                    waveforms
+                    if self._reserve_start is None
+                    else self._stream(self._reserve_start, self._frames_done * shift)
                 )
-                feats = np.stack(self.lfr_splice_cache)
+                feats = self._feat_buf[None, self._feat_beg : self._feat_len]
                 feats_lengths = np.zeros(batch_size, dtype=np.int32) + feats.shape[1]
                 feats, feats_lengths, _ = self.lfr_cmvn(feats, feats_lengths, is_final)
         if is_final:
@@ -364,27 +577,115 @@ class WavFrontendOnline(WavFrontend):
 
     def cache_reset(self):
         self.fbank_fn = knf.OnlineFbank(self.opts)
-        self.reserve_waveforms = None
-        self.input_cache = None
-        self.lfr_splice_cache = []
+        self._frames_done = 0
+        self._sample_offset = self._sample_end = 0
+        self._reserve_start = None
+        self._feat_beg = self._feat_len = 0
+        self._splice_ready = False
 
 
 def load_bytes(input):
-    middle_data = np.frombuffer(input, dtype=np.int16)
-    middle_data = np.asarray(middle_data)
-    if middle_data.dtype.kind not in "iu":
-        raise TypeError("'middle_data' must be an array of integers")
-    dtype = np.dtype("float32")
-    if dtype.kind != "f":
-        raise TypeError("'dtype' must be a floating point type")
-
-    i = np.iinfo(middle_data.dtype)
-    abs_max = 2 ** (i.bits - 1)
-    offset = i.min + abs_max
-    array = np.frombuffer((middle_data.astype(dtype) - offset) / abs_max, dtype=np.float32)
+    """16 bit little-endian PCM bytes as float32 samples in [-1, 1), converted in one pass."""
+    array = np.frombuffer(input, dtype="<i2").astype(np.float32)
+    array *= np.float32(1.0 / (1 << 15))
     return array
 
 
+class PcmRingBuffer:
+    """
+    Raw PCM chunks converted straight into a preallocated float32 buffer.
+
+    `push` takes bytes-like chunks of 16 bit (`sample_format="int16"`) or 32 bit float
+    little-endian PCM, keeps a trailing partial sample for the next chunk, and scales the
+    samples into the buffer without intermediate arrays. `read` hands out a view of the
+    samples not read yet, valid until the next `push`. Consumed samples are compacted away
+    when space runs out, so the buffer stays at `capacity` while the reader keeps up; with
+    `keep_history` nothing is dropped and `history()` is the whole stream. Once the stream
+    outgrows `max_history` samples the history is given up and the buffer is compacted as
+    without it, so memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 16000 * 10,
+        sample_format: str = "int16",
+        keep_history: bool = False,
+        max_history: int = None,
+    ):
+        if sample_format not in ("int16", "float32"):
+            raise ValueError(f"sample_format must be 'int16' or 'float32', got {sample_format}")
+        self.sample_dtype = np.dtype("<i2" if sample_format == "int16" else "<f4")
+        self.keep_history = keep_history
+        self.max_history = max_history
+        self.buffer = np.empty(capacity, dtype=np.float32)
+        self.start = 0  # first sample not read yet
+        self.end = 0  # one past the last sample written
+        self.num_written = 0
+        self._partial = bytearray()
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def push(self, data) -> int:
+        """Append a chunk, returns the number of complete samples it added."""
+        data = memoryview(data).cast("B")
+        itemsize = self.sample_dtype.itemsize
+        written = 0
+        if self._partial:
+            need = itemsize - len(self._partial)
+            self._partial += data[:need]
+            data = data[need:]
+            if len(self._partial) < itemsize:
+                return 0
+            written += self._write(np.frombuffer(self._partial, dtype=self.sample_dtype))
+            self._partial.clear()
+        usable = len(data) - len(data) % itemsize
+        self._partial += data[usable:]
+        written += self._write(np.frombuffer(data[:usable], dtype=self.sample_dtype))
+        return written
+
+    def read(self, max_samples: int = None) -> np.ndarray:
+        end = self.end if max_samples is None else min(self.end, self.start + max_samples)
+        view = self.buffer[self.start : end]
+        self.start = end
+        return view
+
+    def history(self) -> np.ndarray:
+        if not self.keep_history:
+            raise RuntimeError("PcmRingBuffer was created without keep_history or outgrew max_history")
+        return self.buffer[: self.end]
+
+    def reset(self):
+        self.start = self.end = self.num_written = 0
+        self._partial.clear()
+
+    def _write(self, samples: np.ndarray) -> int:
+        n = len(samples)
+        self._reserve(n)
+        out = self.buffer[self.end : self.end + n]
+        if self.sample_dtype.kind == "f":
+            np.copyto(out, samples)
+        else:
+            np.multiply(samples, np.float32(1.0 / (1 << 15)), out=out)
+        self.end += n
+        self.num_written += n
+        return n
+
+    def _reserve(self, n: int):
+        if self.keep_history and self.max_history is not None and self.end + n > self.max_history:
+            self.keep_history = False
+        if self.end + n <= len(self.buffer):
+            return
+        if not self.keep_history and self.start:
+            unread = self.end - self.start
+            self.buffer[:unread] = self.buffer[self.start : self.end]
+            self.start, self.end = 0, unread
+        if self.end + n > len(self.buffer):
+            grown = np.empty(max(2 * len(self.buffer), self.end + n), dtype=np.float32)
+            grown[: self.end] = self.buffer[: self.end]
+            self.buffer = grown
+
+
 class SinusoidalPositionEncoderOnline:
     """Streaming Positional encoding."""
 
@@ -1,7 +1,16 @@
 # -*- encoding: utf-8 -*-
 
 import functools
+import hashlib
+import json
 import logging
+import os
+import platform
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
 
@@ -183,14 +192,181 @@ class ONNXRuntimeError(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=None)
+def cpu_features() -> str:
+    """Digest of the CPU's instruction set extensions (the flags / Features line of
+    /proc/cpuinfo, the processor name elsewhere)."""
+    features = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name.strip() in ("flags", "Features"):
+                    features = " ".join(sorted(value.split()))
+                    break
+    except OSError:
+        pass
+    return hashlib.sha256(f"{platform.machine()}:{features}".encode()).hexdigest()[:16]
+
+
+class OrtModelCache:
+    """
+    ORT-optimized graphs on disk, one per (model sha256, onnxruntime version and build,
+    execution providers and their options, optimization level, machine and CPU features).
+
+    Optimized graphs can contain kernels picked for the CPU's instruction set, so hosts with
+    different CPUs get separate entries and may share one cache directory.
+
+    An entry is `<stem>-<key>.onnx` plus a `.json` sidecar with the key fields and the file
+    size; it is only used when both agree. Writing goes through a temporary file and a rename,
+    so concurrent workers never load a partial graph. Entries of the same model with another
+    key (new weights, ORT upgrade, ...) are removed as stale.
+    """
+
+    HASH_MEMO = "model_hashes.json"
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def model_hash(self, model_file: Union[str, Path]) -> str:
+        """sha256 of the model, memoized by path, size and mtime so restarts skip rehashing."""
+        model_file = Path(model_file).resolve()
+        stat = model_file.stat()
+        memo_key = f"{model_file}:{stat.st_size}:{stat.st_mtime_ns}"
+        memo_path = self.cache_dir / self.HASH_MEMO
+        try:
+            memo = json.loads(memo_path.read_text())
+        except (OSError, ValueError):
+            memo = {}
+        if memo_key not in memo:
+            sha = hashlib.sha256()
+            with open(model_file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            memo = {k: v for k, v in memo.items() if not k.startswith(f"{model_file}:")}
+            memo[memo_key] = sha.hexdigest()
+            self._write_atomic(memo_path, json.dumps(memo, indent=1).encode())
+        return memo[memo_key]
+
+    def entry(self, model_file, providers, graph_optimization_level: str) -> Dict[str, Any]:
+        import onnxruntime
+
+        fields = {
+            "model": str(Path(model_file).resolve()),
+            "sha256": self.model_hash(model_file),
+            "onnxruntime": onnxruntime.__version__,
+            "onnxruntime_build": onnxruntime.get_build_info() if hasattr(onnxruntime, "get_build_info") else None,
+            "providers": [[name, dict(sorted(options.items()))] for name, options in providers],
+            "graph_optimization_level": graph_optimization_level,
+            "machine": platform.machine(),
+            "cpu_features": cpu_features(),
+        }
+        digest = hashlib.sha256(
+            json.dumps({k: v for k, v in fields.items() if k != "model"}, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        fields["key"] = digest
+        fields["path"] = str(self.cache_dir / f"{Path(model_file).stem}-{digest}.onnx")
+        return fields
+
+    def lookup(self, entry: Dict[str, Any]):
+        """Path of a valid cached graph for `entry`, or None (invalid entries are removed)."""
+        path = Path(entry["path"])
+        meta_path = path.with_suffix(".json")
+        if not path.exists() or not meta_path.exists():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text())
+            if meta.get("key") == entry["key"] and meta.get("size") == path.stat().st_size:
+                return str(path)
+        except (OSError, ValueError):
+            pass
+        self.remove(path)
+        return None
+
+    def tmp_path(self, entry: Dict[str, Any]) -> str:
+        return f"{entry['path']}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def commit(self, entry: Dict[str, Any], tmp_path: str):
+        """Publish a graph written by ORT to `tmp_path`, then drop stale entries of the model."""
+        path = Path(entry["path"])
+        os.replace(tmp_path, path)
+        meta = dict(entry, size=path.stat().st_size, created=time.time())
+        self._write_atomic(path.with_suffix(".json"), json.dumps(meta, indent=1).encode())
+        self.cleanup(entry)
+
+    def cleanup(self, entry: Dict[str, Any]):
+        """Remove entries of the same model under another key on this kind of CPU, and of
+        models that are gone."""
+        stem = Path(entry["model"]).stem
+        for meta_path in self.cache_dir.glob(f"{stem}-*.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                continue
+            stale = (
+                meta.get("model") == entry["model"]
+                and meta.get("key") != entry["key"]
+                and meta.get("cpu_features") == entry["cpu_features"]
+            )
+            if stale or not Path(meta.get("model", "")).exists():
+                self.remove(meta_path.with_suffix(".onnx"))
+
+    @staticmethod
+    def remove(path: Union[str, Path]):
+        path = Path(path)
+        for p in (path, path.with_suffix(".json")):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+
 class OrtInferSession:
-    def __init__(self, model_file, device_id=-1, intra_op_num_threads=4):
+    """
+    io_binding: bind inputs and outputs explicitly. Output buffers are allocated once per input
+    shape (at most `max_bound_shapes` of them, least recently used first out) and reused; one
+    call at a time binds, runs and reads them, so `run(..., postprocess)` sees the buffers of
+    its own call and plain calls get copies.
+    cache_dir: keep the optimized graph in an `OrtModelCache` and load it as is next time,
+    which skips graph optimization on cold start.
+    """
+
+    def __init__(
+        self,
+        model_file,
+        device_id=-1,
+        intra_op_num_threads=4,
+        inter_op_num_threads=None,
+        enable_cpu_mem_arena=False,
+        io_binding=False,
+        max_bound_shapes=32,
+        session_config=None,
+        graph_optimization_level="all",
+        cache_dir=None,
+    ):
         device_id = str(device_id)
         sess_opt = SessionOptions()
         sess_opt.intra_op_num_threads = intra_op_num_threads
+        if inter_op_num_threads is not None:
+            sess_opt.inter_op_num_threads = inter_op_num_threads
         sess_opt.log_severity_level = 4
-        sess_opt.enable_cpu_mem_arena = False
-        sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_opt.enable_cpu_mem_arena = enable_cpu_mem_arena
+        # "disable" for graphs that were already optimized offline (see utils.export_utils)
+        sess_opt.graph_optimization_level = {
+            "disable": GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[graph_optimization_level]
+        for key, value in (session_config or {}).items():
+            sess_opt.add_session_config_entry(key, str(value))
 
         cuda_ep = "CUDAExecutionProvider"
         cuda_provider_options = {
@@ -210,7 +386,17 @@ class OrtInferSession:
         EP_list.append((cpu_ep, cpu_provider_options))
 
         self._verify_model(model_file)
-        self.session = InferenceSession(model_file, sess_options=sess_opt, providers=EP_list)
+        if cache_dir is not None and graph_optimization_level != "disable":
+            self.session = self._load_cached(model_file, sess_opt, EP_list, graph_optimization_level, cache_dir)
+        else:
+            self.session = InferenceSession(model_file, sess_options=sess_opt, providers=EP_list)
+        self.input_names = [v.name for v in self.session.get_inputs()]
+        self.output_names = [v.name for v in self.session.get_outputs()]
+
+        self.io_binding = self.session.io_binding() if io_binding else None
+        self.max_bound_shapes = max_bound_shapes
+        self._output_buffers = OrderedDict()
+        self._binding_lock = threading.Lock()
 
         if device_id != "-1" and cuda_ep not in self.session.get_providers():
             warnings.warn(
@@ -222,21 +408,91 @@ class OrtInferSession:
             )
 
     def __call__(self, input_content: List[Union[np.ndarray, np.ndarray]]) -> np.ndarray:
-        input_dict = dict(zip(self.get_input_names(), input_content))
+        return self.run(input_content)
+
+    @staticmethod
+    def _load_cached(model_file, sess_opt, EP_list, graph_optimization_level, cache_dir):
+        cache = OrtModelCache(cache_dir)
+        entry = cache.entry(model_file, EP_list, graph_optimization_level)
+        cached = cache.lookup(entry)
+        if cached is not None:
+            level = sess_opt.graph_optimization_level
+            sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                return InferenceSession(cached, sess_options=sess_opt, providers=EP_list)
+            except Exception:
+                get_logger().warning(f"dropping unreadable optimized model {cached}")
+                cache.remove(cached)
+                sess_opt.graph_optimization_level = level
+
+        tmp_path = cache.tmp_path(entry)
+        sess_opt.optimized_model_filepath = tmp_path
+        try:
+            session = InferenceSession(model_file, sess_options=sess_opt, providers=EP_list)
+            if os.path.exists(tmp_path):
+                cache.commit(entry, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return session
+
+    def run(self, input_content: List[np.ndarray], postprocess=None):
+        """Run and apply `postprocess` to the outputs, same interface as `OrtSessionPool.run`.
+        With io_binding, `postprocess` runs on the reused buffers before another call may bind
+        them; without it the caller gets copies."""
+        if self.io_binding is None:
+            outputs = self._run(input_content)
+            return postprocess(outputs) if postprocess is not None else outputs
+        with self._binding_lock:
+            outputs = self._run(input_content)
+            if postprocess is not None:
+                return postprocess(outputs)
+            return [y.copy() for y in outputs]
+
+    def _run(self, input_content: List[np.ndarray]) -> List[np.ndarray]:
         try:
-            return self.session.run(self.get_output_names(), input_dict)
+            if self.io_binding is not None:
+                return self._run_with_binding(input_content)
+            return self.session.run(self.output_names, dict(zip(self.input_names, input_content)))
         except Exception as e:
             raise ONNXRuntimeError("ONNXRuntime inferece failed.") from e
 
+    def _run_with_binding(self, input_content: List[np.ndarray]) -> List[np.ndarray]:
+        binding = self.io_binding
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        input_content = [np.ascontiguousarray(x) for x in input_content]
+        for name, x in zip(self.input_names, input_content):
+            binding.bind_cpu_input(name, x)
+
+        key = tuple((x.dtype.str, x.shape) for x in input_content)
+        buffers = self._output_buffers.get(key)
+        if buffers is None:
+            # first call with these shapes: let ORT allocate, then keep same-sized buffers
+            for name in self.output_names:
+                binding.bind_output(name, "cpu")
+            self.session.run_with_iobinding(binding)
+            outputs = binding.copy_outputs_to_cpu()
+            self._output_buffers[key] = [np.empty_like(y) for y in outputs]
+            if len(self._output_buffers) > self.max_bound_shapes:
+                self._output_buffers.popitem(last=False)
+            return outputs
+
+        self._output_buffers.move_to_end(key)
+        for name, y in zip(self.output_names, buffers):
+            binding.bind_output(name, "cpu", 0, y.dtype, y.shape, y.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return buffers
+
     def get_input_names(
         self,
     ):
-        return [v.name for v in self.session.get_inputs()]
+        return self.input_names
 
     def get_output_names(
         self,
     ):
-        return [v.name for v in self.session.get_outputs()]
+        return self.output_names
 
     def get_character_list(self, key: str = "character"):
         return self.meta_dict[key].splitlines()
@@ -256,6 +512,152 @@ class OrtInferSession:
             raise FileExistsError(f"{model_path} is not a file.")
 
 
+def numa_cpu_groups() -> List[List[int]]:
+    """CPUs this process may run on, grouped by NUMA node (one group when unknown)."""
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    groups = []
+    for node in sorted(Path("/sys/devices/system/node").glob("node[0-9]*")):
+        try:
+            cpulist = (node / "cpulist").read_text().strip()
+        except OSError:
+            continue
+        cpus = set()
+        for part in filter(None, cpulist.split(",")):
+            beg, _, end = part.partition("-")
+            cpus.update(range(int(beg), int(end or beg) + 1))
+        group = [c for c in allowed if c in cpus]
+        if group:
+            groups.append(group)
+    return groups or [allowed]
+
+
+class OrtSessionPool:
+    """
+    K `OrtInferSession`s over the same model, each owning its own slice of cores.
+
+    Cores are split per NUMA node, so a session never spans two nodes; with `pin_threads` the
+    intra-op threads of a session are pinned to its cores. Calls from several threads (or
+    `map`) run on different sessions concurrently; a call waits when all sessions are busy.
+    """
+
+    def __init__(
+        self,
+        model_file,
+        num_sessions=None,
+        threads_per_session=None,
+        device_id=-1,
+        pin_threads=True,
+        **session_kwargs,
+    ):
+        groups = sorted(numa_cpu_groups(), key=len, reverse=True)
+        num_cpus = sum(len(g) for g in groups)
+        if num_sessions is None:
+            num_sessions = max(1, num_cpus // (threads_per_session or 4))
+        num_sessions = min(num_sessions, num_cpus)
+
+        # sessions are dealt to NUMA nodes in proportion to their cores, and the cores of a
+        # node are split evenly between its sessions
+        if num_sessions < len(groups):
+            shares = [1] * num_sessions + [0] * (len(groups) - num_sessions)
+        else:
+            shares = [min(len(g), max(1, num_sessions * len(g) // num_cpus)) for g in groups]
+            g = 0
+            while sum(shares) < num_sessions:
+                if shares[g % len(groups)] < len(groups[g % len(groups)]):
+                    shares[g % len(groups)] += 1
+                g += 1
+            while sum(shares) > num_sessions:
+                shares[shares.index(max(shares))] -= 1
+        self.core_sets = []
+        for group, share in zip(groups, shares):
+            for chunk in np.array_split(np.array(group), share) if share else []:
+                self.core_sets.append(chunk.tolist()[: threads_per_session or None])
+
+        session_config = session_kwargs.pop("session_config", None) or {}
+        self.sessions = []
+        for cores in self.core_sets:
+            config = dict(session_config)
+            if pin_threads and len(cores) > 1:
+                # the calling thread is the first intra-op thread, the others are listed here (1-based)
+                config["session.intra_op_thread_affinities"] = ";".join(str(c + 1) for c in cores[1:])
+            self.sessions.append(
+                OrtInferSession(
+                    model_file,
+                    device_id,
+                    intra_op_num_threads=len(cores),
+                    session_config=config,
+                    **session_kwargs,
+                )
+            )
+        self.input_names = self.sessions[0].input_names
+        self.output_names = self.sessions[0].output_names
+
+        self._idle = queue.LifoQueue()
+        for i in range(len(self.sessions)):
+            self._idle.put(i)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.sessions))
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._calls = [0] * len(self.sessions)
+        self._busy = [0.0] * len(self.sessions)
+        self._wait = 0.0
+
+    @property
+    def num_sessions(self) -> int:
+        return len(self.sessions)
+
+    def run(self, input_content: List[np.ndarray], postprocess=None):
+        """Run on an idle session; `postprocess` sees the outputs before the session is released,
+        which matters with io_binding where the outputs are that session's reusable buffers."""
+        t0 = time.perf_counter()
+        i = self._idle.get()
+        t1 = time.perf_counter()
+        try:
+            return self.sessions[i].run(input_content, postprocess)
+        finally:
+            t2 = time.perf_counter()
+            with self._lock:
+                self._calls[i] += 1
+                self._busy[i] += t2 - t1
+                self._wait += t1 - t0
+            self._idle.put(i)
+
+    def __call__(self, input_content: List[np.ndarray]) -> List[np.ndarray]:
+        return self.run(input_content)
+
+    def map(self, fn, items):
+        """`fn(item)` for every item on the pool's worker threads, results in order; `fn` is
+        expected to call `run`."""
+        return list(self._executor.map(fn, items))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            calls = sum(self._calls)
+            return {
+                "sessions": [
+                    {
+                        "cores": cores,
+                        "calls": n,
+                        "busy_s": round(busy, 3),
+                        "utilization": round(busy / elapsed, 4) if elapsed > 0 else 0.0,
+                    }
+                    for cores, n, busy in zip(self.core_sets, self._calls, self._busy)
+                ],
+                "calls": calls,
+                "utilization": round(sum(self._busy) / (elapsed * len(self.sessions)), 4) if elapsed > 0 else 0.0,
+                "mean_wait_ms": round(self._wait / calls * 1000, 3) if calls else 0.0,
+                "idle_sessions": self._idle.qsize(),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._started = time.perf_counter()
+            self._calls = [0] * len(self.sessions)
+            self._busy = [0.0] * len(self.sessions)
+            self._wait = 0.0
+
+
 def split_to_mini_sentence(words: list, word_limit: int = 20):
     assert word_limit > 1
     if len(words) <= word_limit:
@@ -4,10 +4,9 @@
 #  MIT License  (https://opensource.org/licenses/MIT)
 
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Union, Tuple
-import torch
-import librosa
 import numpy as np
 
 from utils.infer_utils import (
@@ -15,15 +14,22 @@ from utils.infer_utils import (
     Hypothesis,
     ONNXRuntimeError,
     OrtInferSession,
+    OrtSessionPool,
     TokenIDConverter,
     get_logger,
     read_yaml,
 )
+from utils.audio_io import read_audio
 from utils.frontend import WavFrontend
 from utils.infer_utils import pad_list
 
 logging = get_logger()
 
+# ids of the language / text-normalization query embeddings, as SenseVoiceSmall.lid_dict and
+# textnorm_dict in model.py
+LID_DICT = {"auto": 0, "zh": 3, "en": 4, "yue": 7, "ja": 11, "ko": 12, "nospeech": 13}
+TEXTNORM_DICT = {"withitn": 14, "woitn": 15}
+
 
 class SenseVoiceSmallONNX:
     """
@@ -41,9 +47,27 @@ class SenseVoiceSmallONNX:
         quantize: bool = False,
         intra_op_num_threads: int = 4,
         cache_dir: str = None,
+        io_binding: bool = False,
+        length_buckets: Tuple[int, ...] = (64, 128, 192, 256, 320),
         **kwargs,
     ):
-        if quantize:
+        """
+        io_binding: run the session with reusable output buffers; features are then padded to
+        the next of `length_buckets` (LFR frames, multiples of the largest one beyond it) so the
+        number of distinct buffer shapes stays small. That needs a graph whose attention mask
+        follows the padded input length (exported from this repo's model.py); graphs that build
+        it from `speech_lengths.max()`, as stock FunASR exports do, fail on padded input, which a
+        dry run at load time detects, and are then padded to the batch maximum only.
+        kwargs: inter_op_num_threads / enable_cpu_mem_arena for OrtInferSession; num_sessions > 1
+        (or "auto") runs batches concurrently on an OrtSessionPool with `intra_op_num_threads`
+        cores per session.
+        cache_dir: directory of ORT-optimized graphs reused across restarts (see OrtModelCache).
+        feat_workers (kwargs, default 4): threads computing the features of a batch.
+        """
+        if kwargs.get("model_file"):
+            # one of the variants listed in the export manifest, see utils.export_utils
+            model_file = os.path.join(model_dir, kwargs["model_file"])
+        elif quantize:
             model_file = os.path.join(model_dir, "model_quant.onnx")
         else:
             model_file = os.path.join(model_dir, "model.onnx")
@@ -59,49 +83,107 @@ class SenseVoiceSmallONNX:
         self.tokenizer = CharTokenizer()
         config["frontend_conf"]['cmvn_file'] = cmvn_file
         self.frontend = WavFrontend(**config["frontend_conf"])
-        self.ort_infer = OrtInferSession(
-            model_file, device_id, intra_op_num_threads=intra_op_num_threads
+        session_kwargs = dict(
+            # *_opt.onnx graphs are ORT_ENABLE_ALL output already
+            graph_optimization_level="disable" if model_file.endswith("_opt.onnx") else "all",
+            inter_op_num_threads=kwargs.get("inter_op_num_threads"),
+            enable_cpu_mem_arena=kwargs.get("enable_cpu_mem_arena", False),
+            io_binding=io_binding,
+            cache_dir=cache_dir,
         )
+        num_sessions = kwargs.get("num_sessions", 1)
+        if num_sessions == "auto" or num_sessions > 1:
+            self.ort_infer = OrtSessionPool(
+                model_file,
+                num_sessions=None if num_sessions == "auto" else num_sessions,
+                threads_per_session=intra_op_num_threads,
+                device_id=device_id,
+                **session_kwargs,
+            )
+        else:
+            self.ort_infer = OrtInferSession(
+                model_file, device_id, intra_op_num_threads=intra_op_num_threads, **session_kwargs
+            )
+        self.length_buckets = sorted(length_buckets) if io_binding and length_buckets else None
+        if self.length_buckets is not None and not self._accepts_padding():
+            logging.warning(
+                f"{model_file} does not accept input padded beyond the longest item "
+                "(re-export it from this repo's model.py to use length buckets); padding to the batch maximum"
+            )
+            self.length_buckets = None
         self.batch_size = batch_size
+        feat_workers = min(kwargs.get("feat_workers", 4), batch_size)
+        self.feat_executor = ThreadPoolExecutor(feat_workers, "feat") if feat_workers > 1 else None
         self.blank_id = 0
 
-    def __call__(self, 
-                 wav_content: Union[str, np.ndarray, List[str]], 
-                 language: List, 
-                 textnorm: List,
+    def __call__(self,
+                 wav_content: Union[str, np.ndarray, List[str]],
+                 language: Union[int, List],
+                 textnorm: Union[int, List],
                  tokenizer=None,
                  **kwargs) -> List:
+        """language / textnorm: one id for all inputs, or one id per input."""
         waveform_list = self.load_data(wav_content, self.frontend.opts.frame_opts.samp_freq)
         waveform_nums = len(waveform_list)
-        asr_res = []
-        for beg_idx in range(0, waveform_nums, self.batch_size):
-            end_idx = min(waveform_nums, beg_idx + self.batch_size)
-            feats, feats_len = self.extract_feat(waveform_list[beg_idx:end_idx])
-            ctc_logits, encoder_out_lens = self.infer(feats, 
-                                 feats_len, 
-                                 np.array(language, dtype=np.int32), 
-                                 np.array(textnorm, dtype=np.int32)
-                                 )
-            # back to torch.Tensor
-            ctc_logits = torch.from_numpy(ctc_logits).float()
-            # support batch_size=1 only currently
-            x = ctc_logits[0, : encoder_out_lens[0].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
-
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
-            
-            if tokenizer is not None:
-                asr_res.append(tokenizer.tokens2text(token_int))
-            else:
-                asr_res.append(token_int)
+        language = self._per_item(language, waveform_nums)
+        textnorm = self._per_item(textnorm, waveform_nums)
+        # batch inputs of similar length together to keep padding small
+        order = sorted(range(waveform_nums), key=lambda i: len(waveform_list[i]))
+        batches = [order[beg_idx : beg_idx + self.batch_size] for beg_idx in range(0, waveform_nums, self.batch_size)]
+
+        def run_batch(batch):
+            feats, feats_len = self.extract_feat([waveform_list[i] for i in batch])
+            # decode while the outputs (reusable io_binding buffers) still belong to this batch
+            return self.ort_infer.run([feats, feats_len, language[batch], textnorm[batch]],
+                                      postprocess=lambda outputs: self.greedy_decode(*outputs))
+
+        if isinstance(self.ort_infer, OrtSessionPool) and len(batches) > 1:
+            decoded = self.ort_infer.map(run_batch, batches)
+        else:
+            decoded = [run_batch(batch) for batch in batches]
+
+        asr_res = [None] * waveform_nums
+        for batch, token_ints in zip(batches, decoded):
+            for i, token_int in zip(batch, token_ints):
+                if tokenizer is not None:
+                    asr_res[i] = tokenizer.tokens2text(token_int)
+                else:
+                    asr_res[i] = token_int
         return asr_res
 
+    def _accepts_padding(self) -> bool:
+        """Dry run with features padded past their length, which graphs masking by
+        `speech_lengths.max()` reject with a broadcast error."""
+        length = self.length_buckets[0]
+        feats = np.zeros((1, length, self.frontend.feat_dim()), dtype=np.float32)
+        inputs = [feats, np.array([length // 2], dtype=np.int32), np.zeros(1, np.int32), np.full(1, 15, np.int32)]
+        try:
+            self.ort_infer.run(inputs, postprocess=lambda outputs: None)
+        except ONNXRuntimeError:
+            return False
+        return True
+
+    @staticmethod
+    def _per_item(ids: Union[int, List], num: int) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+        if ids.size == 1:
+            return np.full(num, ids[0], dtype=np.int32)
+        if ids.size != num:
+            raise ValueError(f"expected 1 or {num} ids, got {ids.size}")
+        return ids
+
+    def greedy_decode(self, ctc_logits: np.ndarray, encoder_out_lens: np.ndarray) -> List[List[int]]:
+        """Greedy CTC over the whole batch: argmax, drop repeats, blanks and padded frames."""
+        yseq = ctc_logits.argmax(axis=-1)
+        keep = np.arange(yseq.shape[1])[None, :] < np.asarray(encoder_out_lens).reshape(-1, 1)
+        keep[:, 1:] &= yseq[:, 1:] != yseq[:, :-1]
+        keep &= yseq != self.blank_id
+        counts = keep.sum(axis=1)
+        return [tokens.tolist() for tokens in np.split(yseq[keep], np.cumsum(counts)[:-1])]
+
     def load_data(self, wav_content: Union[str, np.ndarray, List[str]], fs: int = None) -> List:
         def load_wav(path: str) -> np.ndarray:
-            waveform, _ = librosa.load(path, sr=fs)
-            return waveform
+            return read_audio(path, int(fs))
 
         if isinstance(wav_content, np.ndarray):
             return [wav_content]
@@ -110,21 +192,25 @@ class SenseVoiceSmallONNX:
             return [load_wav(wav_content)]
 
         if isinstance(wav_content, list):
-            return [load_wav(path) for path in wav_content]
+            return [path if isinstance(path, np.ndarray) else load_wav(path) for path in wav_content]
 
         raise TypeError(f"The type of {wav_content} is not in [str, np.ndarray, list]")
 
     def extract_feat(self, waveform_list: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
-        feats, feats_len = [], []
-        for waveform in waveform_list:
-            speech, _ = self.frontend.fbank(waveform)
-            feat, feat_len = self.frontend.lfr_cmvn(speech)
-            feats.append(feat)
-            feats_len.append(feat_len)
-
-        feats = self.pad_feats(feats, np.max(feats_len))
-        feats_len = np.array(feats_len).astype(np.int32)
-        return feats, feats_len
+        max_feat_len = max(self.frontend.num_lfr_frames(len(waveform)) for waveform in waveform_list)
+        feats = np.empty(
+            (len(waveform_list), self.padded_length(max_feat_len), self.frontend.feat_dim()), dtype=np.float32
+        )
+        return self.frontend.extract_batch(waveform_list, out=feats, executor=self.feat_executor)
+
+    def padded_length(self, max_feat_len: int) -> int:
+        if self.length_buckets is None:
+            return max_feat_len
+        for bucket in self.length_buckets:
+            if max_feat_len <= bucket:
+                return bucket
+        step = self.length_buckets[-1]
+        return -(-max_feat_len // step) * step
 
     @staticmethod
     def pad_feats(feats: List[np.ndarray], max_feat_len: int) -> np.ndarray:
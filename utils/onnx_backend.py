@@ -0,0 +1,202 @@
+# -*- encoding: utf-8 -*-
+
+import os
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+from utils.audio_io import VAD_LOOKBACK_MS, SampleWindow, StreamingVadMerger, iter_audio_blocks, read_audio
+from utils.audio_io import merge_vad as merge_vad_segments
+from utils.export_utils import select_variant
+from utils.infer_utils import get_logger, read_yaml
+from utils.model_bin import LID_DICT, TEXTNORM_DICT, SenseVoiceSmallONNX
+from utils.vad_bin import FsmnVadONNX
+
+logging = get_logger()
+
+
+class SentencePieceIdTokenizer:
+    """`tokens2text` over token ids, which is what SenseVoiceSmallONNX hands to its tokenizer."""
+
+    def __init__(self, bpemodel: Union[str, Path]):
+        import sentencepiece as spm
+
+        self.sp = spm.SentencePieceProcessor()
+        self.sp.Load(str(bpemodel))
+
+    def tokens2text(self, token_ids: List[int]) -> str:
+        return self.sp.DecodeIds(token_ids)
+
+
+def vad_segments(
+    vad, waveform: np.ndarray, fs: int = 16000, merge_vad: bool = True, merge_length_s: int = 15
+) -> List[np.ndarray]:
+    """Views of `waveform` for the segments a VAD (`FsmnVadONNX` or a funasr VAD AutoModel)
+    finds, merged like AutoModel."""
+    segments = vad.generate(input=waveform, fs=fs)[0]["value"]
+    if merge_vad:
+        segments = merge_vad_segments(segments, merge_length_s * 1000)
+    samples_per_ms = fs // 1000
+    return [
+        waveform[int(beg * samples_per_ms) : min(int(end * samples_per_ms), len(waveform))]
+        for beg, end in segments
+    ]
+
+
+class SenseVoiceONNXPipeline:
+    """
+    FSMN-VAD segmentation followed by SenseVoiceSmall, both on ONNX Runtime (torch and funasr
+    are not imported).
+
+    `generate` mirrors the subset of `funasr.AutoModel.generate` the service uses: the VAD
+    segments are merged up to `merge_length_s`, recognized, and their texts joined with a
+    space as AutoModel does. Audio files are read, resampled, segmented and recognized block
+    by block (see `generate_stream`), so memory does not grow with the recording length.
+    """
+
+    def __init__(
+        self,
+        model_dir: Union[str, Path],
+        vad_model_dir: Union[str, Path],
+        max_single_segment_time: int = 10000,
+        quantize: bool = False,
+        batch_size: int = 1,
+        intra_op_num_threads: int = 4,
+        device_id: Union[str, int] = "-1",
+        variant: str = None,
+        cer_budget: float = 0.01,
+        block_seconds: int = 10,
+        **kwargs,
+    ):
+        """variant: model file inside `model_dir`, or "auto" for the fastest one in the export
+        manifest within `cer_budget` of float32 (see `utils.export_utils.select_variant`).
+        block_seconds: audio decoded and passed to the VAD at a time when reading files.
+        vad_model_dir: an exported FSMN-VAD with model.onnx, see `utils.vad_bin.FsmnVadONNX`."""
+        if variant == "auto":
+            variant = select_variant(model_dir, cer_budget, default="model_quant.onnx" if quantize else "model.onnx")
+        if variant:
+            logging.info(f"ONNX model variant: {variant}")
+            kwargs["model_file"] = variant
+
+        self.asr = SenseVoiceSmallONNX(
+            model_dir,
+            batch_size=batch_size,
+            device_id=device_id,
+            quantize=quantize,
+            intra_op_num_threads=intra_op_num_threads,
+            **kwargs,
+        )
+        config = read_yaml(os.path.join(model_dir, "config.yaml"))
+        bpemodel = os.path.basename(config["tokenizer_conf"]["bpemodel"])
+        self.tokenizer = SentencePieceIdTokenizer(os.path.join(model_dir, bpemodel))
+        # the FSMN VAD is small enough for one CPU thread next to the ASR session
+        self.vad = FsmnVadONNX(
+            vad_model_dir, max_single_segment_time=max_single_segment_time, cache_dir=kwargs.get("cache_dir")
+        )
+        self.fs = int(self.asr.frontend.opts.frame_opts.samp_freq)
+        self.batch_size = batch_size
+        self.block_seconds = block_seconds
+
+    def stats(self) -> dict:
+        """Per-session utilization when the ONNX model runs on an OrtSessionPool."""
+        stats = getattr(self.asr.ort_infer, "stats", None)
+        return stats() if stats is not None else {}
+
+    def load_audio(self, audio: Union[str, np.ndarray]) -> np.ndarray:
+        if isinstance(audio, np.ndarray):
+            return audio.astype(np.float32, copy=False)
+        return read_audio(audio, self.fs)
+
+    def segment(self, waveform: np.ndarray, merge_vad: bool = True, merge_length_s: int = 15) -> List[np.ndarray]:
+        return vad_segments(self.vad, waveform, self.fs, merge_vad, merge_length_s)
+
+    def generate(
+        self,
+        input: Union[str, np.ndarray],
+        language: str = "auto",
+        use_itn: bool = False,
+        merge_vad: bool = True,
+        merge_length_s: int = 15,
+        **kwargs,
+    ) -> List[dict]:
+        if isinstance(input, (str, Path)) and os.path.isfile(input):
+            texts = self.generate_stream(input, language, use_itn, merge_vad, merge_length_s)
+            return [{"key": "onnx", "text": " ".join(texts)}]
+        waveform = self.load_audio(input)
+        segments = [s for s in self.segment(waveform, merge_vad, merge_length_s) if len(s)]
+        if not segments:
+            return [{"key": "onnx", "text": ""}]
+        return [{"key": "onnx", "text": " ".join(self.recognize(segments, language, use_itn))}]
+
+    def recognize(self, segments: List[np.ndarray], language: str = "auto", use_itn: bool = False) -> List[str]:
+        textnorm = "withitn" if use_itn else "woitn"
+        return self.asr(
+            segments,
+            language=LID_DICT.get(language, 0),
+            textnorm=TEXTNORM_DICT[textnorm],
+            tokenizer=self.tokenizer,
+        )
+
+    def generate_stream(
+        self,
+        path: Union[str, Path],
+        language: str = "auto",
+        use_itn: bool = False,
+        merge_vad: bool = True,
+        merge_length_s: int = 15,
+    ) -> List[str]:
+        """
+        Texts of the segments of an audio file, read block by block.
+
+        Blocks go through the streaming VAD as they are decoded; merged segments are cut from a
+        window of recent audio as soon as they are complete and recognized a few batches at a
+        time, and the audio before the earliest segment still to come is released. Merging
+        follows `merge_vad` except that spans without any speech (the gaps between segments far
+        apart) are not recognized; see `utils.audio_io.StreamingVadMerger`.
+        """
+        block_size = self.block_seconds * self.fs
+        samples_per_ms = self.fs // 1000
+        merger = StreamingVadMerger(merge_length_s * 1000) if merge_vad else None
+        window = SampleWindow(block_size * 4)
+        vad_cache = {}
+        open_beg = None
+        segments, texts = [], []
+
+        def cut(spans):
+            for beg, end in spans:
+                segment = window.slice(beg * samples_per_ms, end * samples_per_ms)
+                if len(segment):
+                    segments.append(segment)
+
+        blocks = iter_audio_blocks(path, self.fs, block_size)
+        block = next(blocks, None)
+        while block is not None:
+            next_block = next(blocks, None)
+            is_final = next_block is None
+            window.append(block)
+            result = self.vad.generate(
+                input=block,
+                cache=vad_cache,
+                is_final=is_final,
+                chunk_size=self.block_seconds * 1000,
+                is_streaming_input=True,
+                fs=self.fs,
+            )
+            for beg, end in result[0]["value"] if result else []:
+                if beg >= 0:
+                    open_beg = beg
+                if end >= 0:
+                    cut(merger.push(open_beg, end) if merger else [[open_beg, end]])
+                    open_beg = None
+            now = window.end // samples_per_ms
+            if merger is not None:
+                cut(merger.finish() if is_final else merger.advance(now, open_beg))
+                window.drop_before(merger.keep_from() * samples_per_ms)
+            else:
+                window.drop_before((open_beg if open_beg is not None else now - VAD_LOOKBACK_MS) * samples_per_ms)
+            if len(segments) >= 4 * self.batch_size or (is_final and segments):
+                texts.extend(self.recognize(segments, language, use_itn))
+                segments.clear()
+            block = next_block
+        return texts
@@ -0,0 +1,93 @@
+# -*- encoding: utf-8 -*-
+
+import os
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+from utils.e2e_vad import E2EVadModel
+from utils.frontend import WavFrontendOnline
+from utils.infer_utils import OrtInferSession, read_yaml
+
+
+class FsmnVadONNX:
+    """
+    FSMN-VAD on ONNX Runtime, without torch or funasr.
+
+    `model_dir` is an exported FunASR VAD (model.onnx or model_quant.onnx next to its
+    config.yaml and am.mvn), e.g. iic/speech_fsmn_vad_zh-cn-16k-common-onnx. `generate` answers
+    the calls the pipelines make on a funasr VAD AutoModel: a whole waveform gives
+    [{"value": [[beg, end], ...]}] in ms; with `is_streaming_input=True` the blocks of one
+    stream share `cache` and segments come back as [beg, -1], [-1, end] or [beg, end] as their
+    ends are detected.
+    """
+
+    def __init__(
+        self,
+        model_dir: Union[str, Path],
+        max_single_segment_time: int = None,
+        quantize: bool = False,
+        intra_op_num_threads: int = 1,
+        device_id: Union[str, int] = "-1",
+        cache_dir: str = None,
+    ):
+        model_file = os.path.join(model_dir, "model_quant.onnx" if quantize else "model.onnx")
+        config = read_yaml(os.path.join(model_dir, "config.yaml"))
+        self.model_conf = dict(config["model_conf"])
+        if max_single_segment_time is not None:
+            self.model_conf["max_single_segment_time"] = max_single_segment_time
+        self.frontend_conf = dict(config["frontend_conf"], cmvn_file=os.path.join(model_dir, "am.mvn"), dither=0.0)
+        self.encoder_conf = config["encoder_conf"]
+        self.ort_infer = OrtInferSession(
+            model_file, device_id, intra_op_num_threads=intra_op_num_threads, cache_dir=cache_dir
+        )
+        self.max_end_sil = self.model_conf["max_end_silence_time"]
+        self.fs = int(self.frontend_conf.get("fs", 16000))
+
+    def init_cache(self) -> dict:
+        """State of one stream: the online frontend, the FSMN memories and the endpoint detector."""
+        shape = (1, self.encoder_conf["proj_dim"], self.encoder_conf["lorder"] - 1, 1)
+        return {
+            "frontend": WavFrontendOnline(**self.frontend_conf),
+            "in_cache": [np.zeros(shape, dtype=np.float32) for _ in range(self.encoder_conf["fsmn_layers"])],
+            "scorer": E2EVadModel(self.model_conf),
+        }
+
+    def accept(self, waveform: np.ndarray, cache: dict, is_final: bool = False, online: bool = True) -> List[List[int]]:
+        """Segments detected after feeding `waveform` to the stream; offline (`online=False`) only
+        complete ones are returned until `is_final`."""
+        frontend = cache["frontend"]
+        waveform = np.asarray(waveform, dtype=np.float32)
+        feats, _ = frontend.extract_fbank(waveform[None, :], np.array([len(waveform)]), is_final)
+        if feats.size == 0:
+            return []
+        outputs = self.ort_infer([feats.astype(np.float32, copy=False), *cache["in_cache"]])
+        cache["in_cache"] = outputs[1:]
+        segments = cache["scorer"](
+            outputs[0], frontend.get_waveforms(), is_final=is_final, max_end_sil=self.max_end_sil, online=online
+        )
+        return segments[0] if segments else []
+
+    def __call__(self, waveform: np.ndarray, chunk_ms: int = 60000) -> List[List[int]]:
+        """[beg, end] (ms) of the speech in a whole waveform, scored `chunk_ms` at a time."""
+        cache = self.init_cache()
+        step = chunk_ms * self.fs // 1000
+        num_chunks = len(waveform) // step + 1
+        segments = []
+        for i in range(num_chunks):
+            chunk = waveform[i * step : (i + 1) * step]
+            segments.extend(self.accept(chunk, cache, i == num_chunks - 1, online=False))
+        return segments
+
+    def generate(
+        self, input: np.ndarray, cache: dict = None, is_final: bool = True, is_streaming_input: bool = False, **kwargs
+    ) -> List[dict]:
+        if not is_streaming_input:
+            return [{"key": "vad", "value": self(input)}]
+        if "scorer" not in cache:
+            cache.update(self.init_cache())
+        segments = self.accept(input, cache, is_final)
+        if is_final:
+            cache.clear()
+        return [{"key": "vad", "value": segments}]